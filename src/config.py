@@ -1,10 +1,10 @@
 import os
-import plotly.express as px
+import types
+from functools import lru_cache
 
 # --- Google Sheets Configuration ---
 # Replace with the actual name of your MAIN Google Sheet file
-GOOGLE_SHEET_URL = "https://docs.google.com/spreadsheets/d/1UmTDfLCU3FUtBnQMSR8yhmfzLBHP8uNXrd2NSjeyS9Y/" # Example URL
-ASSOC_COLS = ["colaborador_username", "cliente_nome"]
+GOOGLE_SHEET_URL = os.environ.get("SAI_GOOGLE_SHEET_URL", "https://docs.google.com/spreadsheets/d/1UmTDfLCU3FUtBnQMSR8yhmfzLBHP8uNXrd2NSjeyS9Y/") # Example URL
 # Names of the CENTRAL worksheets within the main Google Sheet
 SHEET_USERS = "usuarios"
 SHEET_CLIENTS = "clientes"
@@ -14,19 +14,30 @@ SHEET_ASSOC = "colaborador_cliente"
 SHEET_ERROR_LOGS = "logs_de_erros"
 SHEET_AUDIT_LOGS = "logs_de_auditoria"
 
+# --- Sheets API caching / batching ---
+SHEETS_METADATA_TTL_SECONDS = 300 # How long worksheet handles are reused before re-fetching spreadsheet metadata
+SHEETS_BATCH_GET_RANGES = (SHEET_USERS, SHEET_CLIENTS, SHEET_ASSOC) # Central sheets read with one values.batchGet
+SHEETS_FETCH_WORKERS = 8 # Concurrent per-sheet reads when the batched read is unavailable
+SHEETS_RETRY_ATTEMPTS = 5 # Tries per Sheets write on quota (429) / transient server errors
+SHEETS_RETRY_BASE_DELAY = 1.0 # Seconds; doubles per retry (plus jitter), capped at 32s
+
 # Convention for user-specific document sheets (will be prefixed)
 # The user's username will be appended, e.g., "docs_diogo"
 USER_DOCS_SHEET_PREFIX = "docs_"
 
 # Expected columns for each CENTRAL sheet (ensure they match your sheet)
-# Add/remove columns as needed
-USERS_COLS = ["username", "hashed_password", "nome_completo", "role", "last_sync_timestamp"] # Added timestamp
-CLIENTS_COLS = ["id", "nome", "tipo"] # 'tipo' is crucial here
-ASSOC_COLS = ["colaborador_username", "cliente_id"] # Example if using associations sheet
+# Add/remove columns as needed. Tuples so callers can't mutate them; use list(...) where pandas needs a list
+USERS_COLS = ("username", "hashed_password", "nome_completo", "role", "last_sync_timestamp") # Added timestamp
+CLIENTS_COLS = ("id", "nome", "tipo") # 'tipo' is crucial here
+ASSOC_COLS = ("colaborador_username", "cliente_id") # Example if using associations sheet
+# Column name -> 0-based position, for O(1) lookups instead of *_COLS.index(...)
+USERS_COL_IDX = {name: i for i, name in enumerate(USERS_COLS)}
+CLIENTS_COL_IDX = {name: i for i, name in enumerate(CLIENTS_COLS)}
+ASSOC_COL_IDX = {name: i for i, name in enumerate(ASSOC_COLS)}
 
 # Expected columns for the USER document sheets (adjust!)
 # These MUST match the columns in your `docs_username` sheets
-DOCS_COLS = [
+DOCS_COLS = (
     "id",
     "colaborador_username",
     "cliente_nome", # Retained for easier display/initial mapping
@@ -41,43 +52,63 @@ DOCS_COLS = [
     "data_validacao",       # Timestamp when validation occurred
     "validado_por",         # Username of the admin who validated
     "observacoes_validacao" # Optional: Admin comments
-]
+)
+DOCS_COL_IDX = {name: i for i, name in enumerate(DOCS_COLS)}
 
 # --- NEW: Columns for Log Sheets ---
-ERROR_LOG_COLS = ["timestamp", "username", "function_name", "error_type", "error_message", "traceback_snippet"]
-AUDIT_LOG_COLS = ["timestamp", "admin_username", "action_type", "target_user", "target_entity", "details"]
+ERROR_LOG_COLS = ("timestamp", "username", "function_name", "error_type", "error_message", "traceback_snippet")
+AUDIT_LOG_COLS = ("timestamp", "admin_username", "action_type", "target_user", "target_entity", "details")
 
 
 
 # --- Configurações da Interface ---
-BASE_PATH = os.path.dirname(os.path.abspath(__file__)) # Config is at root
+BASE_PATH = os.path.dirname(os.path.abspath(__file__)) # Directory holding config.py (src/)
 LOGO_PATH_RELATIVE = os.path.join("src", "images", "logo_sai.png") # Adjust path if needed
-LOGO_PATH = "src/images/logo_sai.png"
-if not os.path.exists(LOGO_PATH): LOGO_PATH = "logo_sai.png" # Fallback
-if not os.path.exists(LOGO_PATH): LOGO_PATH = None # Or set to None if not found
+
+@lru_cache(maxsize=128)
+def asset(*parts):
+    """Absolute path of a file shipped next to config.py, e.g. asset("images", "logo_sai.png")."""
+    return os.path.join(BASE_PATH, *parts)
+
+@lru_cache(maxsize=1)
+def _resolve_logo_path():
+    """Returns the first existing logo location (most common layout first), or None."""
+    candidates = (
+        LOGO_PATH_RELATIVE, # Running from the repo root
+        asset("images", "logo_sai.png"), # Absolute, independent of cwd
+        "logo_sai.png", # Fallback
+    )
+    return next((path for path in candidates if os.path.exists(path)), None)
+
+LOGO_PATH = os.environ.get("SAI_LOGO_PATH") or _resolve_logo_path() # Deployments can pin the path and skip the probes
 
 
 # --- App Behavior ---
 APP_TITLE = "SAI - Sistema Híbrido de Acesso à Informação"
 DEFAULT_ADMIN_USER = "admin"
-DEFAULT_ADMIN_PASS = "admin" # Change in production!
+DEFAULT_ADMIN_PASS = os.environ.get("SAI_DEFAULT_ADMIN_PASS", "admin") # Change in production!
 
 # Define valid statuses for easy reference and dropdowns
-VALID_STATUSES = ['Cadastrado', 'Validado', 'Inválido'] # Add 'Inválido'
+VALID_STATUSES = ('Cadastrado', 'Validado', 'Inválido') # Add 'Inválido'
+VALID_STATUS_SET = frozenset(VALID_STATUSES) # O(1) membership checks on write paths
 
 
 # --- Dashboard Appearance ---
-DEFAULT_BAR_COLOR = px.colors.qualitative.Plotly[0]
+DEFAULT_BAR_COLOR = "#636EFA" # px.colors.qualitative.Plotly[0], frozen to avoid importing plotly here
 HIGHLIGHT_BAR_COLOR = "#636EFA"
-CRITERIA_COLORS = {'Essencial': '#2ca02c', 'Obrigatório': '#ff7f0e', 'Recomendado': '#ffdd71'} # Match criteria names
+CRITERIA_COLORS = types.MappingProxyType({'Essencial': '#2ca02c', 'Obrigatório': '#ff7f0e', 'Recomendado': '#ffdd71'}) # Match criteria names
 DEFAULT_CRITERIA_COLOR = '#888888'
 
 # --- Outras Configurações (Legacy/Adaptable) ---
-VALID_UPLOAD_ROLES = ['Admin', 'Usuario', 'Cliente'] # Keep for potential future features
-CLIENT_UPLOAD_REQUIRED_COLS = ['nome', 'tipo']
-ASSOC_UPLOAD_REQUIRED_COLS = ['colaborador_username', 'cliente_nome']
+VALID_UPLOAD_ROLES = ('Admin', 'Usuario', 'Cliente') # Keep for potential future features
+VALID_UPLOAD_ROLE_SET = frozenset(VALID_UPLOAD_ROLES) # Hash lookup / Series.isin on validation paths
+CLIENT_UPLOAD_REQUIRED_COLS = ('nome', 'tipo')
+ASSOC_UPLOAD_REQUIRED_COLS = ('colaborador_username', 'cliente_nome')
 
 # --- User Authentication ---
-DEFAULT_ADMIN_USERNAME = "admin"
-DEFAULT_ADMIN_PASSWORD = "admin_password" # Change this in a real environment!
-MIN_PASSWORD_LENGTH = 5 # Minimum password length
\ No newline at end of file
+MIN_PASSWORD_LENGTH = 5 # Minimum password length
+# scrypt work factors for stored password hashes (~50 ms / 16 MB per hash).
+# Raising them is safe: older hashes are re-hashed on the next successful login.
+PASSWORD_SCRYPT_N = 2**14
+PASSWORD_SCRYPT_R = 8
+PASSWORD_SCRYPT_P = 1
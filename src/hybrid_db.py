@@ -1,15 +1,262 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import sqlite3
 import gspread
 from google.oauth2.service_account import Credentials # Explicit import
 from datetime import datetime
+import time
+import threading
+import types
+import copy
 import hashlib
+import hmac
+import logging
+import os
+import random
 import uuid # For generating unique IDs for documents
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, wraps
 
 import config
 import sheets_auth # Our authentication module
 
+logger = logging.getLogger(__name__)
+
+
+# --- Password hashing ---
+# Stored format: "scrypt$n$r$p$<salt hex>$<hash hex>".
+# Legacy hashes are bare unsalted SHA-256 hex digests (64 chars); they still verify and get
+# upgraded on the next successful login (see Autenticador._check_login_on_sheets).
+
+def _hash_password(password):
+    """Returns a salted scrypt hash for the password, using the work factors from config."""
+    n, r, p = config.PASSWORD_SCRYPT_N, config.PASSWORD_SCRYPT_R, config.PASSWORD_SCRYPT_P
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p, dklen=32)
+    return f"scrypt${n}${r}${p}${salt.hex()}${digest.hex()}"
+
+def _verificar_senha(stored_hashed_password, provided_password):
+    """Constant-time check of a password against a stored scrypt or legacy SHA-256 hash."""
+    stored = str(stored_hashed_password or '')
+    if stored.startswith('scrypt$'):
+        try:
+            _, n, r, p, salt_hex, digest_hex = stored.split('$')
+            digest = hashlib.scrypt(provided_password.encode('utf-8'), salt=bytes.fromhex(salt_hex),
+                                    n=int(n), r=int(r), p=int(p), dklen=len(digest_hex) // 2)
+        except ValueError: # Malformed hash or bad parameters
+            return False
+        return hmac.compare_digest(digest.hex(), digest_hex)
+    legacy = hashlib.sha256(provided_password.encode('utf-8')).hexdigest()
+    return hmac.compare_digest(legacy, stored)
+
+def _password_needs_rehash(stored_hashed_password):
+    """True for legacy SHA-256 hashes and scrypt hashes made with other work factors."""
+    current_prefix = f"scrypt${config.PASSWORD_SCRYPT_N}${config.PASSWORD_SCRYPT_R}${config.PASSWORD_SCRYPT_P}$"
+    return not str(stored_hashed_password or '').startswith(current_prefix)
+
+
+# Document status -> KPI card slot (statuses not listed only count towards totals)
+_KPI_STATUS_SLOTS = types.MappingProxyType({
+    'Cadastrado': 'docs_enviados',
+    'Validado': 'docs_validados',
+    'Inválido': 'docs_invalidos'
+})
+
+# --- Filtered query text ---
+# Each filter combination maps to one fixed SQL string, so it is built once and sqlite's
+# per-connection statement cache reuses the compiled plan across reruns.
+
+@lru_cache(maxsize=64)
+def _listar_clientes_sql(by_colaborador, n_tipos):
+    query_parts = ["SELECT c.id, c.nome, c.tipo FROM clientes c"]
+    conditions = []
+    if by_colaborador:
+        # Semi-join: each client appears once even if the assignment sheet has repeated rows
+        # (to_sql recreates colaborador_cliente without its PK), so no DISTINCT sort is needed
+        conditions.append("""c.id COLLATE NOCASE IN (
+            SELECT ca.cliente_id FROM colaborador_cliente ca WHERE ca.colaborador_username = ? COLLATE NOCASE
+        )""")
+    if n_tipos:
+        conditions.append(f"c.tipo IN ({_placeholders(n_tipos)})")
+    if conditions:
+        query_parts.append("WHERE " + " AND ".join(conditions))
+    query_parts.append("ORDER BY c.nome")
+    return " ".join(query_parts)
+
+@lru_cache(maxsize=64)
+def _dashboard_snapshot_sql(n_tipos, by_colaborador, by_cliente, by_periodo, n_criterios, cliente_nocase=False):
+    # Conditional aggregation: one result row with every KPI slot and the validated count per criterion.
+    # Bound parameters, in order: one status per _KPI_STATUS_SLOTS slot, one criterion per
+    # n_criterios, then the WHERE filters. cliente_nocase compares cliente_id case-insensitively (the old
+    # analysis query did); that comparison can't use idx_docs_cliente_status, so the KPI path stays exact.
+    aggregates = ["COUNT(*) AS total_documentos"]
+    aggregates += [f"COALESCE(SUM(d.status = ?), 0) AS {slot}" for slot in _KPI_STATUS_SLOTS.values()]
+    aggregates += [f"COALESCE(SUM(d.status = 'Validado' AND d.dimensao_criterio = ?), 0) AS crit_{i}" for i in range(n_criterios)]
+    base_query = f"""
+        SELECT {', '.join(aggregates)}
+        FROM documentos d
+    """
+    conditions = []
+    if n_tipos:
+        base_query += " JOIN clientes c ON d.cliente_id = c.id "
+        conditions.append(f"c.tipo IN ({_placeholders(n_tipos)})")
+    if by_colaborador:
+        conditions.append("d.colaborador_username = ? COLLATE NOCASE")
+    if by_cliente:
+        conditions.append("d.cliente_id = ? COLLATE NOCASE" if cliente_nocase else "d.cliente_id = ?")
+    if by_periodo:
+        conditions.append("d.data_registro >= ?")
+    if conditions:
+        base_query += " WHERE " + " AND ".join(conditions)
+    return base_query
+
+
+# Normalised (stripped, lower-cased) text of an 'id' cell whose id is actually missing
+_MISSING_ID_MARKERS = frozenset({'', 'none', 'nan', 'na', 'nonetype'})
+
+
+def _new_uuid4_strings(n):
+    """n random UUID4 strings (same format as str(uuid.uuid4())) from a single os.urandom call."""
+    raw = os.urandom(16 * n)
+    return [str(uuid.UUID(bytes=raw[i:i + 16], version=4)) for i in range(0, 16 * n, 16)]
+
+
+# Indexes of the local cache, name -> "table (columns)".
+# The 'documentos' ones are dropped before the sheet load and built once afterwards (cheaper than updating
+# them on every INSERT); colaborador_cliente is recreated by to_sql without indexes, so its index can only
+# exist after the load.
+_LOCAL_INDEXES = types.MappingProxyType({
+    # Per-client views filter on cliente_id and group by status/dimensao_criterio, ordering by data_registro
+    'idx_docs_cliente_status': "documentos (cliente_id, status, dimensao_criterio, data_registro)",
+    # Per-collaborator KPIs/ranking; NOCASE to match the 'colaborador_username = ? COLLATE NOCASE' filters
+    'idx_docs_colab_status': "documentos (colaborador_username COLLATE NOCASE, status)",
+    # Unsynced-docs list / save / leftover check ('... COLLATE NOCASE AND is_synced = ?'), newest first
+    'idx_docs_colab_sync': "documentos (colaborador_username COLLATE NOCASE, is_synced, data_registro)",
+    # Assigned-client lookups (listar_clientes_local, assign/unassign)
+    'idx_assoc_colab': "colaborador_cliente (colaborador_username COLLATE NOCASE, cliente_id)",
+})
+
+_LOCAL_UNIQUE_INDEXES = types.MappingProxyType({
+    # Client names are unique case-insensitively; add_cliente_local_and_gsheet relies on it for dedup
+    'idx_clientes_nome_nocase': "clientes (nome COLLATE NOCASE)",
+})
+
+def _read_cache_key(value):
+    """Hashable stand-in for a read argument (filters arrive as lists from multiselects)."""
+    return tuple(value) if isinstance(value, (list, set)) else value
+
+
+def _cached_local_read(method):
+    """
+    Memoizes a local read on the manager until the next local write, so Streamlit reruns
+    (every widget interaction) don't repeat the same query. Callers get a copy of the result.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__,
+               tuple(_read_cache_key(a) for a in args),
+               tuple(sorted((k, _read_cache_key(v)) for k, v in kwargs.items())))
+        # Lookup, query and store under the session lock (an RLock, so the nested _execute_local_sql is fine):
+        # a write + cache clear from another thread (e.g. the sheet-write worker's rollback) can't slip in
+        # between the query and the store and leave a stale result cached
+        with self._lock:
+            result = self._read_cache.get(key)
+            if result is None:
+                result = method(self, *args, **kwargs)
+                if result is None: # Query error: don't cache it
+                    return None
+                self._read_cache[key] = result
+        if isinstance(result, pd.DataFrame):
+            return result.copy()
+        return list(result) if isinstance(result, list) else copy.deepcopy(result)
+    return wrapper
+
+
+@lru_cache(maxsize=None)
+def _col_letter(col):
+    """A1 column letters for a 1-based column index (3 -> 'C'); sheets are narrow, so this stays tiny."""
+    return gspread.utils.rowcol_to_a1(1, col)[:-1] # 'C1' -> 'C'
+
+
+class _AssignmentSyncError(Exception):
+    """A background append to the associations sheet failed; `assignments` were rolled back locally."""
+    def __init__(self, assignments, cause):
+        super().__init__(f"{len(assignments)} atribuição(ões) não salvas: {cause}")
+        self.assignments = assignments
+        self.cause = cause
+
+
+_SHEETS_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def _sheets_call(fn, *args, retry_server_errors=True, **kwargs):
+    """
+    Runs a Google Sheets call, retrying quota (429) and transient 5xx errors with exponential backoff.
+    Non-idempotent writes (appends, row deletions) pass retry_server_errors=False: a 5xx may arrive
+    after the server already applied them, so only the 429 rejections are retried.
+    """
+    for attempt in range(config.SHEETS_RETRY_ATTEMPTS):
+        try:
+            return fn(*args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            retryable = status == 429 or (retry_server_errors and status in _SHEETS_RETRY_STATUSES)
+            if not retryable or attempt == config.SHEETS_RETRY_ATTEMPTS - 1:
+                raise
+            delay = min(32.0, config.SHEETS_RETRY_BASE_DELAY * 2 ** attempt) + random.uniform(0, 1)
+            logger.warning(f"Sheets API {status} on {getattr(fn, '__name__', fn)}; retrying in {delay:.1f}s "
+                           f"({attempt + 1}/{config.SHEETS_RETRY_ATTEMPTS})")
+            time.sleep(delay)
+
+
+_SQL_IN_CHUNK = 500 # Máximo de valores por IN (...), abaixo do limite de 999 parâmetros do SQLite
+
+def _a1_sheet(name):
+    """Quoted sheet name for an A1 range; embedded apostrophes are doubled (D'Ávila -> 'D''Ávila')."""
+    return "'" + str(name).replace("'", "''") + "'"
+
+@lru_cache(maxsize=128)
+def _placeholders(n):
+    """'?,?,...' for an IN (...) list of n values; the same few lengths keep coming back."""
+    return ','.join('?' * n)
+
+# Sheet-ordered projection for uploads. A missing cliente_id is resolved from the client name in the same
+# query (the old per-row lookup); when no client matches, the stored value is kept.
+_UPLOAD_DOCS_COLUMNS = ", ".join(
+    f"""COALESCE(CASE WHEN d.cliente_id IS NULL OR d.cliente_id = '' THEN
+           (SELECT c.id FROM clientes c WHERE c.nome = d.cliente_nome COLLATE NOCASE LIMIT 1) END,
+         d.cliente_id) AS cliente_id""" if col == 'cliente_id' else f'd."{col}"'
+    for col in config.DOCS_COLS
+)
+
+def _in_chunks(values):
+    """Splits a list of IN (...) values into slices of at most _SQL_IN_CHUNK."""
+    for i in range(0, len(values), _SQL_IN_CHUNK):
+        yield values[i:i + _SQL_IN_CHUNK]
+
+
+# --- Display helpers shared by the pages ---
+# Cached by value: dates repeat a lot across documents, so each distinct value goes through
+# pd.to_datetime once per process instead of once per row.
+
+@lru_cache(maxsize=4096)
+def format_display_date(date_str, fmt="%d/%m/%Y", missing="N/A"):
+    """Formats a stored date for tables; empty/None/NaN cells show `missing`."""
+    if not date_str or pd.isna(date_str) or str(date_str).lower() == 'none': return missing
+    try: return pd.to_datetime(date_str).strftime(fmt)
+    except (ValueError, TypeError, OverflowError): return str(date_str)
+
+def format_display_datetime(dt_str, fmt="%d/%m/%Y %H:%M", missing="N/A"):
+    """Same as format_display_date, with the time."""
+    return format_display_date(dt_str, fmt, missing)
+
+
+# Set once the default admin is known to exist in the users sheet; lives for the whole server process
+_default_admin_confirmed = False
+
+
 class HybridDBManager:
     """
     Manages data synchronization between Google Sheets (master) and a local
@@ -19,16 +266,35 @@ class HybridDBManager:
         """Initializes the manager, gets gspread client, connects to local DB."""
         self.gc = sheets_auth.get_gspread_client()
         try:
-            print("Opening main spreadsheet...")
+            logger.info("Opening main spreadsheet...")
             self.spreadsheet = self.gc.open_by_url(config.GOOGLE_SHEET_URL)
         except Exception as e:
             st.error(f"Failed to open Google Sheet '{config.GOOGLE_SHEET_URL}': {e}")
             st.stop()
 
-        # Connect to in-memory SQLite database for the session
-        self.local_conn = sqlite3.connect(":memory:", check_same_thread=False)
+        # Worksheet handles keyed by title, refreshed every SHEETS_METADATA_TTL_SECONDS
+        self._worksheet_cache = {}
+        self._worksheet_cache_time = None
+
+        # Connect to in-memory SQLite database for the session.
+        # This single connection lives as long as the manager; every access goes through self._lock
+        # because Streamlit may run callbacks for the same session on different threads.
+        # Prepared statements are reused per SQL text; the dynamic IN (...) / filter queries vary in shape,
+        # so the default LRU of 128 would keep evicting the fixed single-row statements.
+        self._read_cache = {} # See _cached_local_read; emptied on every local write
+        self._user_row_index = {} # lower(username) -> 1-based row in the users sheet, rebuilt on each session load
+        # Assignment appends run here so the UI returns after the local commit; one worker keeps them in order
+        self._gs_exec = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gsheets-sync")
+        self._pending_sheet_writes = []
+        self._sheet_write_errors = [] # Messages for report_sheet_write_failures
+        self.local_conn = sqlite3.connect(":memory:", check_same_thread=False, cached_statements=512)
         self.local_conn.row_factory = sqlite3.Row # Return dict-like rows
-        print("Connected to local in-memory SQLite DB.")
+        self._lock = threading.RLock()
+        # Tune once per connection. WAL/mmap don't apply to a :memory: DB (its journal is always in memory),
+        # but temp B-trees for GROUP BY/ORDER BY and the page cache size still do.
+        for pragma in ("synchronous=OFF", "temp_store=MEMORY", "cache_size=-32000"):
+            self.local_conn.execute(f"PRAGMA {pragma}")
+        logger.info("Connected to local in-memory SQLite DB.")
         self._create_local_tables()
         # Run migration after tables are ensured and clients might be loaded (or will be soon)
         # This relies on clients being loaded before documents for the migration to work effectively in one pass
@@ -38,34 +304,53 @@ class HybridDBManager:
         self._migrate_add_cliente_id_to_documentos_local()
 
 
+    @contextmanager
+    def _local_transaction(self):
+        """Holds the session lock for one write transaction (commit on success, rollback on error)."""
+        # :memory: has no WAL and synchronous is already OFF, so the gain for bulk writes is doing all
+        # statements under a single lock acquisition and a single COMMIT.
+        with self._lock:
+            try:
+                with self.local_conn:
+                    # Explicit BEGIN so reads and writes in the block share one transaction; the default
+                    # isolation_level is kept because pandas.to_sql and the one-off DDL rely on implicit commits.
+                    if not self.local_conn.in_transaction:
+                        self.local_conn.execute("BEGIN")
+                    yield self.local_conn
+            finally:
+                # After COMMIT/ROLLBACK but still under the lock memoized readers take (see _cached_local_read)
+                self._read_cache.clear()
+
     def _execute_local_sql(self, query, params=None, fetch_mode="all"):
         """Helper to execute SQL on the local SQLite DB."""
-        cursor = self.local_conn.cursor()
-        try:
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-
-            if query.strip().upper().startswith("SELECT"):
-                if fetch_mode == "one":
-                    return cursor.fetchone()
-                elif fetch_mode == "all":
-                    return cursor.fetchall()
-                else: # No fetch needed
-                     return None # Or raise error? Indicate no fetch expected
-            else: # For INSERT, UPDATE, DELETE
-                self.local_conn.commit()
-                return cursor.rowcount
-        except sqlite3.Error as e:
-            st.error(f"Local SQLite Error: {e}\nQuery: {query[:100]}...")
-            print(f"Local SQLite Error: {e}\nQuery: {query}\nParams: {params}")
-            return None # Or raise e
+        with self._lock:
+            cursor = self.local_conn.cursor()
+            try:
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+
+                if query.strip().upper().startswith("SELECT"):
+                    if fetch_mode == "one":
+                        return cursor.fetchone()
+                    elif fetch_mode == "all":
+                        return cursor.fetchall()
+                    else: # No fetch needed
+                         return None # Or raise error? Indicate no fetch expected
+                else: # For INSERT, UPDATE, DELETE
+                    self.local_conn.commit()
+                    self._read_cache.clear()
+                    return cursor.rowcount
+            except sqlite3.Error as e:
+                st.error(f"Local SQLite Error: {e}\nQuery: {query[:100]}...")
+                logger.error(f"Local SQLite Error: {e}\nQuery: {query}\nParams: {params}")
+                return None # Or raise e
 
 
     def _create_local_tables(self):
         """Creates the necessary tables in the local in-memory SQLite DB."""
-        print("Creating local SQLite tables...")
+        logger.info("Creating local SQLite tables...")
         # --- Usuarios Table ---
         self._execute_local_sql("""
             CREATE TABLE IF NOT EXISTS usuarios (
@@ -111,29 +396,48 @@ class HybridDBManager:
 
         create_docs_sql = f"CREATE TABLE IF NOT EXISTS documentos ({cols_sql})"
         self._execute_local_sql(create_docs_sql)
-        print("Local SQLite tables created (documentos table now includes cliente_id).")
+
+        self._create_local_indexes()
+        logger.info("Local SQLite tables created (documentos table now includes cliente_id).")
+
+    def _create_local_indexes(self):
+        """Creates the dashboard and uniqueness indexes (no-op for the ones that already exist)."""
+        with self._lock:
+            for index_name, target in _LOCAL_INDEXES.items():
+                self.local_conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {target}")
+            for index_name, target in _LOCAL_UNIQUE_INDEXES.items():
+                try:
+                    self.local_conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {target}")
+                except sqlite3.IntegrityError as e: # Sheet already holds duplicates; keep loading without the constraint
+                    logger.warning(f"Could not create unique index {index_name}: {e}")
+
+    def _drop_documentos_indexes(self):
+        """Drops the 'documentos' indexes before a bulk load; _create_local_indexes rebuilds them afterwards."""
+        with self._lock:
+            for index_name, target in _LOCAL_INDEXES.items():
+                if target.startswith("documentos "):
+                    self.local_conn.execute(f"DROP INDEX IF EXISTS {index_name}")
 
     def _migrate_add_cliente_id_to_documentos_local(self):
         """
         Scans the local 'documentos' table and adds 'cliente_id' by looking up
         'cliente_nome' in the 'clientes' table. Also ensures the column exists.
         """
-        print("Starting migration: Add cliente_id to local documentos table...")
-        cursor = self.local_conn.cursor()
+        logger.info("Starting migration: Add cliente_id to local documentos table...")
         try:
             # 1. Ensure 'cliente_id' column exists in 'documentos'
-            cursor.execute("PRAGMA table_info(documentos)")
-            columns = [info[1] for info in cursor.fetchall()]
+            with self._lock:
+                columns = [info[1] for info in self.local_conn.execute("PRAGMA table_info(documentos)").fetchall()]
             if 'cliente_id' not in columns:
                 self._execute_local_sql("ALTER TABLE documentos ADD COLUMN cliente_id TEXT", fetch_mode=None)
-                print("Column 'cliente_id' added to local 'documentos' table.")
+                logger.info("Column 'cliente_id' added to local 'documentos' table.")
             else:
-                print("Column 'cliente_id' already exists in local 'documentos' table.")
+                logger.info("Column 'cliente_id' already exists in local 'documentos' table.")
 
             # 2. Fetch all clients for mapping
             clients_map_rows = self._execute_local_sql("SELECT id, nome FROM clientes")
             if not clients_map_rows:
-                print("Migration: No clients found in local 'clientes' table. Cannot map cliente_id yet.")
+                logger.info("Migration: No clients found in local 'clientes' table. Cannot map cliente_id yet.")
                 return
 
             clients_map = {row['nome'].lower(): row['id'] for row in clients_map_rows} # Lowercase for case-insensitive matching
@@ -145,96 +449,139 @@ class HybridDBManager:
             )
 
             if not docs_to_update:
-                print("Migration: No documents found needing cliente_id update (or all already have it).")
+                logger.info("Migration: No documents found needing cliente_id update (or all already have it).")
                 return
 
-            print(f"Migration: Found {len(docs_to_update)} documents to potentially update with cliente_id.")
-            updated_count = 0
+            logger.info(f"Migration: Found {len(docs_to_update)} documents to potentially update with cliente_id.")
+            updates = [] # (cliente_id, doc_id) pairs, written in one transaction below
             for doc_row in docs_to_update:
                 doc_id = doc_row['id']
                 cliente_nome = doc_row['cliente_nome']
                 if cliente_nome:
                     cliente_id_found = clients_map.get(cliente_nome.lower())
                     if cliente_id_found:
-                        self._execute_local_sql(
-                            "UPDATE documentos SET cliente_id = ? WHERE id = ?",
-                            (cliente_id_found, doc_id), fetch_mode=None
-                        )
-                        updated_count += 1
+                        updates.append((cliente_id_found, doc_id))
                     else:
-                        print(f"Migration Warning: Cliente ID not found for cliente_nome '{cliente_nome}' (doc_id: {doc_id}).")
-            
+                        logger.debug(f"Migration: Cliente ID not found for cliente_nome '{cliente_nome}' (doc_id: {doc_id}).")
+            updated_count = len(updates)
+
             if updated_count > 0:
-                self.local_conn.commit()
-                print(f"Migration: Successfully updated cliente_id for {updated_count} documents.")
+                with self._local_transaction() as conn:
+                    conn.executemany("UPDATE documentos SET cliente_id = ? WHERE id = ?", updates)
+                logger.info(f"Migration: Successfully updated cliente_id for {updated_count} documents.")
             else:
-                print("Migration: No documents were updated with cliente_id in this pass.")
+                logger.info("Migration: No documents were updated with cliente_id in this pass.")
 
         except sqlite3.Error as e:
             st.error(f"Migration Error (add_cliente_id): {e}")
-            print(f"Migration Error (add_cliente_id): {e}")
+            logger.error(f"Migration Error (add_cliente_id): {e}")
         except Exception as ex: # Catch other potential errors
             st.error(f"General Migration Error (add_cliente_id): {ex}")
-            print(f"General Migration Error (add_cliente_id): {ex}")
+            logger.error(f"General Migration Error (add_cliente_id): {ex}")
+
 
+    def _refresh_worksheet_cache(self, force=False):
+        """Reloads all worksheet handles with a single metadata call once the cache is stale."""
+        now = time.monotonic()
+        if not force and self._worksheet_cache_time is not None \
+                and now - self._worksheet_cache_time < config.SHEETS_METADATA_TTL_SECONDS:
+            return
+        self._worksheet_cache = {ws.title: ws for ws in self.spreadsheet.worksheets()}
+        self._worksheet_cache_time = now
 
     def _get_worksheet(self, sheet_name):
-        """Safely gets a worksheet, returns None if not found."""
+        """Safely gets a worksheet (from the metadata cache), returns None if not found."""
         try:
-            return self.spreadsheet.worksheet(sheet_name)
-        except gspread.exceptions.WorksheetNotFound:
-            print(f"Worksheet '{sheet_name}' not found.")
-            return None
+            self._refresh_worksheet_cache()
+            ws = self._worksheet_cache.get(sheet_name)
+            if ws is None:
+                logger.warning(f"Worksheet '{sheet_name}' not found.")
+            return ws
         except Exception as e:
             st.error(f"Error accessing worksheet '{sheet_name}': {e}")
             return None
 
-    def _load_sheet_to_local_table(self, sheet_name, table_name, expected_cols, if_exists='replace'):
-        """Loads data from a GSheet worksheet into a local SQLite table."""
-        ws = self._get_worksheet(sheet_name)
-        if not ws:
-            if table_name not in ["documentos", "colaborador_cliente"]: # Don't warn for these if they don't exist
-                 st.warning(f"Skipping load for non-existent sheet: {sheet_name}")
-            else:
-                 print(f"Sheet '{sheet_name}' not found, skipping load into '{table_name}'.")
-            return True
+    def _batch_get_sheet_values(self, sheet_names):
+        """
+        Reads every value of several worksheets with one values.batchGet call.
+        Returns {sheet_name: values} for the sheets that exist; on API failure returns
+        an empty dict so callers fall back to per-sheet reads.
+        """
+        existing = [name for name in sheet_names if self._get_worksheet(name)]
+        if not existing:
+            return {}
+        try:
+            response = self.spreadsheet.values_batch_get(ranges=[_a1_sheet(name) for name in existing])
+        except Exception as e:
+            logger.warning(f"Batch read of {existing} failed, falling back to per-sheet reads: {e}")
+            return {}
+
+        values_by_sheet = {}
+        for name, value_range in zip(existing, response.get('valueRanges', [])):
+            values = value_range.get('values', [])
+            width = max((len(row) for row in values), default=0)
+            values_by_sheet[name] = [row + [''] * (width - len(row)) for row in values] # batchGet trims trailing empty cells
+        return values_by_sheet
+
+    def _load_sheet_to_local_table(self, sheet_name, table_name, expected_cols, if_exists='replace', values=None,
+                                   cliente_id_filter=None):
+        """
+        Loads data from a GSheet worksheet into a local SQLite table.
+        `values` can carry the sheet contents already fetched (e.g. by _batch_get_sheet_values).
+        `cliente_id_filter` (documentos only) keeps just the rows of that client.
+        """
+        if values is None:
+            ws = self._get_worksheet(sheet_name)
+            if not ws:
+                if table_name not in ("documentos", "colaborador_cliente"): # Don't warn for these if they don't exist
+                     st.warning(f"Skipping load for non-existent sheet: {sheet_name}")
+                else:
+                     logger.warning(f"Sheet '{sheet_name}' not found, skipping load into '{table_name}'.")
+                return True
 
-        print(f"Loading data from GSheet '{sheet_name}' to local table '{table_name}' (mode: {if_exists})...")
+        logger.info(f"Loading data from GSheet '{sheet_name}' to local table '{table_name}' (mode: {if_exists})...")
+        expected_cols = list(expected_cols) # config exposes tuples; pandas treats a tuple key as a single label
         try:
-            all_values = ws.get_values() # Get all values, including headers
+            all_values = values if values is not None else ws.get_values() # Get all values, including headers
             if len(all_values) < 1: # Check if sheet is completely empty
-                print(f"Sheet '{sheet_name}' is empty.")
+                logger.info(f"Sheet '{sheet_name}' is empty.")
                 if if_exists == 'replace' and table_name != "documentos": # Don't mass delete documents if one user sheet is empty
                     self._execute_local_sql(f"DELETE FROM {table_name}")
                 return True
 
             header = all_values[0]
-            data = all_values[1:]
 
+            # --- Column Validation/Alignment (header only, before touching the body) ---
+            header_pos = {}
+            for pos, col_name in enumerate(header):
+                header_pos.setdefault(col_name, pos) # First occurrence wins on repeated headers
+            cols_to_copy = [col for col in expected_cols if col in header_pos]
+            if not cols_to_copy and expected_cols: # Wrong/renamed sheet: nothing usable, load it as empty
+                logger.warning(f"No common columns between GSheet '{sheet_name}' header and expected columns for '{table_name}'. Skipping load.")
+                if if_exists == 'replace' and table_name != "documentos": # Same as before: the table ends up empty
+                    self._execute_local_sql(f"DELETE FROM {table_name}")
+                return True
+
+            data = all_values[1:]
             if not data: # Check if sheet has only header
-                print(f"Sheet '{sheet_name}' has only a header.")
+                logger.info(f"Sheet '{sheet_name}' has only a header.")
                 if if_exists == 'replace' and table_name != "documentos":
                      self._execute_local_sql(f"DELETE FROM {table_name}")
                 return True
 
-            df = pd.DataFrame(data, columns=header)
-
-            # --- Column Validation/Alignment ---
-            df_selected = pd.DataFrame(columns=expected_cols) # Empty DF with ALL expected cols from config
-
-            # Copy data for columns that exist in both GSheet and expected_cols
-            cols_to_copy = [col for col in expected_cols if col in df.columns]
-            if not cols_to_copy and expected_cols: # If no common columns but we expect some
-                print(f"Warning: No common columns between GSheet '{sheet_name}' header and expected columns for '{table_name}'.")
-            df_selected[cols_to_copy] = df[cols_to_copy]
+            # Materialise only the expected columns (like read_csv usecols); extra sheet columns are never copied.
+            # Sheet values come back rectangular (gspread / _batch_get_sheet_values pad short rows).
+            values_arr = np.array(data, dtype=object)
+            df = pd.DataFrame(values_arr[:, [header_pos[col] for col in cols_to_copy]], columns=cols_to_copy)
 
-            # Fill missing expected columns with None (e.g. 'cliente_id' if GSheet is old)
-            missing_config_cols = [col for col in expected_cols if col not in df.columns]
-            for col in missing_config_cols:
-                df_selected[col] = None
+            # Fill missing expected columns (e.g. 'cliente_id' if GSheet is old). Sheet cells already come back
+            # as str, so the column gets the same 'None' text the old whole-frame astype(str) produced.
+            for col in expected_cols:
+                if col not in header_pos:
+                    df[col] = 'None'
 
-            # Ensure correct order and only expected columns
-            df = df_selected[expected_cols].astype(str) # Convert all to string for SQLite
+            # Ensure correct order and only expected columns (no astype(str) copy: everything is str already)
+            df = df[expected_cols]
 
             # --- Special handling for 'documentos' table ---
             if table_name == "documentos":
@@ -246,38 +593,74 @@ class HybridDBManager:
                     # Get a map of cliente_nome to cliente_id from the local 'clientes' table
                     clients_map_rows = self._execute_local_sql("SELECT id, nome FROM clientes")
                     clients_map = {row['nome'].lower(): row['id'] for row in clients_map_rows} if clients_map_rows else {}
-                    
-                    def get_cliente_id(row):
-                        if pd.isna(row['cliente_id']) or str(row['cliente_id']).strip() == '' or str(row['cliente_id']).lower() == 'none':
-                            return clients_map.get(str(row['cliente_nome']).lower())
-                        return row['cliente_id']
 
                     if not clients_map:
-                        print(f"Warning: Clientes map is empty. Cannot populate 'cliente_id' for docs from '{sheet_name}' at this stage.")
+                        logger.warning(f"Clientes map is empty. Cannot populate 'cliente_id' for docs from '{sheet_name}' at this stage.")
                     else:
-                        df['cliente_id'] = df.apply(get_cliente_id, axis=1)
-                        num_filled = df['cliente_id'].notna().sum() - df_selected['cliente_id'].notna().sum()
+                        # Resolve all missing ids in one vectorized lookup instead of a row-wise apply
+                        ids_str = df['cliente_id'].str.strip()
+                        mask_missing_cliente = ids_str.eq('') | ids_str.str.lower().eq('none')
+                        df.loc[mask_missing_cliente, 'cliente_id'] = df.loc[mask_missing_cliente, 'cliente_nome'].str.lower().map(clients_map)
+                        num_filled = int(df.loc[mask_missing_cliente, 'cliente_id'].notna().sum())
                         if num_filled > 0:
-                            print(f"Filled {num_filled} missing 'cliente_id' values for docs from '{sheet_name}' using local clientes map.")
+                            logger.info(f"Filled {num_filled} missing 'cliente_id' values for docs from '{sheet_name}' using local clientes map.")
+
+                if cliente_id_filter:
+                    # Runs after the cliente_id fill so rows from older sheets (name only) are matched too
+                    df = df[df['cliente_id'] == cliente_id_filter].copy()
 
                 # Generate UUIDs for 'id' if missing
                 if 'id' in df.columns:
-                    mask_missing_id = df['id'].isin(['', 'None', None, 'nan', 'NA', 'NoneType'])
-                    num_missing_ids = mask_missing_id.sum()
+                    # Column is already str here, so None/NaN show up as 'None'/'nan'. Normalise once, then a
+                    # single hash lookup per cell (also catches ' ', 'NaN', 'none' typed by hand in the sheet)
+                    mask_missing_id = df['id'].str.strip().str.lower().isin(_MISSING_ID_MARKERS).to_numpy()
+                    id_arr = df['id'].to_numpy(dtype=object)
+                    num_missing_ids = int(mask_missing_id.sum())
                     if num_missing_ids > 0:
-                        print(f"Generating {num_missing_ids} missing UUIDs for 'id' column in docs from '{sheet_name}'.")
-                        df.loc[mask_missing_id, 'id'] = [str(uuid.uuid4()) for _ in range(num_missing_ids)]
+                        logger.info(f"Generating {num_missing_ids} missing UUIDs for 'id' column in docs from '{sheet_name}'.")
+                        id_arr[mask_missing_id] = _new_uuid4_strings(num_missing_ids)
+                        df['id'] = id_arr
             
-            # Insert into SQLite table
-            df.to_sql(table_name, self.local_conn, if_exists=if_exists, index=False, chunksize=1000)
-            print(f"Successfully loaded {len(df)} rows from '{sheet_name}' to '{table_name}'.")
+            if if_exists == 'append' and table_name == "documentos":
+                # 'documentos' always exists with its own schema (PK + indexes): one prepared INSERT,
+                # executemany over the rows and a single COMMIT, without pandas' SQL layer in between.
+                # OR REPLACE on the id PK: a repeated id of the same collaborator (copied row, sheet loaded twice)
+                # keeps the last copy instead of rolling back the whole sheet with an IntegrityError.
+                # An id already loaded from another collaborator's sheet is kept and the new row skipped (with a
+                # warning), so one collaborator's document can't silently overwrite another's.
+                columns_str = ", ".join(f'"{c}"' for c in df.columns)
+                insert_query = f'INSERT OR REPLACE INTO {table_name} ({columns_str}) VALUES ({", ".join(["?"] * len(df.columns))})'
+                with self._local_transaction() as conn:
+                    if 'colaborador_username' in df.columns:
+                        owner_by_id = {}
+                        for chunk in _in_chunks(df['id'].tolist()):
+                            owner_by_id.update(conn.execute(
+                                f"SELECT id, colaborador_username FROM documentos WHERE id IN ({_placeholders(len(chunk))})", chunk
+                            ).fetchall())
+                        if owner_by_id:
+                            owners = df['colaborador_username'].str.lower().tolist()
+                            keep = [str(owner_by_id.get(doc_id, owner)).lower() == owner
+                                    for doc_id, owner in zip(df['id'].tolist(), owners)]
+                            conflicts = df.loc[[not k for k in keep]]
+                            for doc_id, owner in zip(conflicts['id'], conflicts['colaborador_username']):
+                                logger.warning(f"Documento '{doc_id}' de '{owner}' (planilha '{sheet_name}') ignorado: "
+                                               f"o mesmo id já foi carregado para '{owner_by_id[doc_id]}'.")
+                            df = df.loc[keep]
+                    conn.executemany(insert_query, df.itertuples(index=False, name=None))
+            else:
+                # Insert into SQLite table with multi-row INSERT ... VALUES (...),(...) statements.
+                # Rows per statement stay under SQLite's default 999 bound-parameter limit.
+                rows_per_insert = max(1, 999 // max(1, len(df.columns)))
+                with self._lock:
+                    df.to_sql(table_name, self.local_conn, if_exists=if_exists, index=False,
+                              chunksize=rows_per_insert, method='multi')
+                    self._read_cache.clear()
+            logger.info(f"Successfully loaded {len(df)} rows from '{sheet_name}' to '{table_name}'.")
             return True
 
         except Exception as e:
             st.error(f"Error loading data from sheet '{sheet_name}' to table '{table_name}': {e}")
-            print(f"Traceback during load_sheet_to_local_table for {sheet_name}:")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"Traceback during load_sheet_to_local_table for {sheet_name}:")
             return False
 
     def _get_user_sheet_name(self, username):
@@ -286,18 +669,58 @@ class HybridDBManager:
 
     # _load_user_docs_to_local is now handled by _load_sheet_to_local_table with if_exists='append' for documents
 
-    def load_data_for_session(self, username, role):
-        """Loads all necessary data from Google Sheets into local SQLite for the session."""
-        with st.spinner("Carregando dados da planilha... Por favor, aguarde."):
-            print(f"Starting data load for user: {username}, role: {role}")
+    def _fetch_sheet_values_parallel(self, sheet_names):
+        """
+        Reads several worksheets with one get_values() call each, run concurrently (the calls are
+        pure network wait). Returns {sheet_name: values}; sheets that don't exist or fail are left
+        out so _load_sheet_to_local_table handles and reports them on its own.
+        """
+        # Resolve handles here: _get_worksheet may call st.* which needs the script thread
+        worksheets = {}
+        for name in sheet_names:
+            ws = self._get_worksheet(name)
+            if ws:
+                worksheets[name] = ws
+        if not worksheets:
+            return {}
+
+        def fetch(ws):
+            try:
+                return ws.get_values()
+            except Exception as e:
+                logger.warning(f"Parallel read of '{ws.title}' failed, it will be retried on its own: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=min(config.SHEETS_FETCH_WORKERS, len(worksheets))) as executor:
+            fetched = zip(worksheets, executor.map(fetch, worksheets.values()))
+            return {name: values for name, values in fetched if values is not None}
 
-            # 1. Load Central Sheets (Replace mode)
-            load_success = self._load_sheet_to_local_table(config.SHEET_USERS, "usuarios", config.USERS_COLS, if_exists='replace')
+    def load_data_for_session(self, username, role, users_values=None):
+        """
+        Loads all necessary data from Google Sheets into local SQLite for the session.
+        `users_values` is the users sheet already read at login (header + rows); when given it is not fetched again.
+        """
+        with st.spinner("Carregando dados da planilha... Por favor, aguarde."):
+            logger.info(f"Starting data load for user: {username}, role: {role}")
+            self._wait_for_sheet_writes() # Otherwise the reload could miss assignments still being appended
+            self._refresh_worksheet_cache(force=True) # A full reload is the natural point to revalidate sheet metadata
+
+            # 1. Load Central Sheets (Replace mode), fetched together in one batchGet
+            central_sheets = [name for name in config.SHEETS_BATCH_GET_RANGES
+                              if not (name == config.SHEET_USERS and users_values is not None)]
+            central_values = self._batch_get_sheet_values(central_sheets)
+            if users_values is not None:
+                central_values[config.SHEET_USERS] = users_values
+            load_success = self._load_sheet_to_local_table(config.SHEET_USERS, "usuarios", config.USERS_COLS, if_exists='replace',
+                                                           values=central_values.get(config.SHEET_USERS))
             if not load_success: st.stop()
-            load_success = self._load_sheet_to_local_table(config.SHEET_CLIENTS, "clientes", config.CLIENTS_COLS, if_exists='replace')
+            self._index_user_rows(central_values.get(config.SHEET_USERS))
+            load_success = self._load_sheet_to_local_table(config.SHEET_CLIENTS, "clientes", config.CLIENTS_COLS, if_exists='replace',
+                                                           values=central_values.get(config.SHEET_CLIENTS))
             if not load_success: st.stop() # Clients are crucial for cliente_id mapping
-            load_success = self._load_sheet_to_local_table(config.SHEET_ASSOC, "colaborador_cliente", config.ASSOC_COLS, if_exists='replace')
-            if not load_success: print(f"Warning: Falha ao carregar a planilha de associações '{config.SHEET_ASSOC}'.")
+            load_success = self._load_sheet_to_local_table(config.SHEET_ASSOC, "colaborador_cliente", config.ASSOC_COLS, if_exists='replace',
+                                                           values=central_values.get(config.SHEET_ASSOC))
+            if not load_success: logger.warning(f"Falha ao carregar a planilha de associações '{config.SHEET_ASSOC}'.")
 
             # --- Run migration for cliente_id in documentos AFTER clientes table is loaded ---
             # This ensures the clients_map in migration has data
@@ -305,136 +728,148 @@ class HybridDBManager:
 
 
             # 2. Load Document Sheets (Append mode into 'documentos' table)
-            # Clear local documents table first to avoid duplicates from previous sessions/users if append is used.
+            # Clear local documents table first: the appends are idempotent on 'id', but rows removed from
+            # the sheets since the last load would otherwise stay in the cache.
             self._execute_local_sql("DELETE FROM documentos")
-            print("Cleared existing local 'documentos' table before loading user sheets.")
+            self._drop_documentos_indexes()
+            logger.info("Cleared existing local 'documentos' table before loading user sheets.")
 
             user_sheets_to_load = []
+            docs_cliente_filter = None
             if role == 'Admin':
-                print("Admin role: Loading all user document sheets...")
-                users_df = pd.read_sql("SELECT username FROM usuarios WHERE role = 'Usuario'", self.local_conn)
-                if not users_df.empty:
-                    user_sheets_to_load = [self._get_user_sheet_name(uname) for uname in users_df['username']]
+                logger.info("Admin role: Loading all user document sheets...")
+                user_sheets_to_load = [self._get_user_sheet_name(row['username']) for row in
+                                       self._execute_local_sql("SELECT username FROM usuarios WHERE role = 'Usuario'") or []]
             elif role == 'Usuario':
                 user_sheets_to_load = [self._get_user_sheet_name(username)]
-                print(f"Loading document sheet for user '{username}': {user_sheets_to_load[0]}")
+                logger.info(f"Loading document sheet for user '{username}': {user_sheets_to_load[0]}")
             elif role == 'Cliente':
-                # For 'Cliente', load all user sheets. Filtering by 'cliente_nome' (or 'cliente_id')
-                # will happen in the UI or data retrieval methods.
-                print("Cliente role: Loading all user document sheets for potential visibility...")
-                users_df = pd.read_sql("SELECT username FROM usuarios WHERE role = 'Usuario'", self.local_conn)
-                if not users_df.empty:
-                    user_sheets_to_load = [self._get_user_sheet_name(uname) for uname in users_df['username']]
-
+                # For 'Cliente', read all user sheets but keep only this client's rows in the local cache
+                # (its views only query by cliente_id). Without a resolved id everything is loaded, as before.
+                docs_cliente_filter = st.session_state.get('cliente_id_logado')
+                logger.info(f"Cliente role: Loading user document sheets filtered to cliente_id {docs_cliente_filter}...")
+                user_sheets_to_load = [self._get_user_sheet_name(row['username']) for row in
+                                       self._execute_local_sql("SELECT username FROM usuarios WHERE role = 'Usuario'") or []]
+
+            # All user sheets in one values.batchGet instead of one round trip per sheet;
+            # sheets missing from the result (or a failed batch) fall back to a per-sheet read.
+            docs_values = self._batch_get_sheet_values(user_sheets_to_load) if len(user_sheets_to_load) > 1 else {}
+            if len(user_sheets_to_load) > 1:
+                docs_values.update(self._fetch_sheet_values_parallel(
+                    [name for name in user_sheets_to_load if name not in docs_values]))
             all_docs_loaded_successfully = True
             for sheet_name in user_sheets_to_load:
                  # Use 'append' because we cleared 'documentos' once, and now aggregate all user sheets.
-                 if not self._load_sheet_to_local_table(sheet_name, "documentos", config.DOCS_COLS, if_exists='append'):
+                 if not self._load_sheet_to_local_table(sheet_name, "documentos", config.DOCS_COLS, if_exists='append',
+                                                        values=docs_values.get(sheet_name),
+                                                        cliente_id_filter=docs_cliente_filter):
                       all_docs_loaded_successfully = False # Keep track if any sheet fails
 
             if not all_docs_loaded_successfully:
                 st.warning("Falha ao carregar dados de documentos de um ou mais usuários. A visão pode estar incompleta.")
 
-            st.session_state['data_loaded'] = True
-            st.session_state['last_load_time'] = datetime.now()
-            print(f"Data load complete at {st.session_state['last_load_time']}.")
+            # Build the indexes once over the loaded rows, then refresh planner statistics so they get picked
+            self._create_local_indexes()
+            self._execute_local_sql("ANALYZE")
+
+            load_time = datetime.now()
+            st.session_state.update({'data_loaded': True, 'last_load_time': load_time})
+            logger.info(f"Data load complete at {load_time}.")
 
 
     # --- Local Read Methods ---
 
     def buscar_usuario_local(self, username):
         """Fetches a user from the local SQLite cache."""
-        return self._execute_local_sql("SELECT * FROM usuarios WHERE username = ?", (username,), fetch_mode="one")
+        # Explicit column list keeps the statement text fixed so sqlite's statement cache reuses the plan
+        return self._execute_local_sql(
+            "SELECT username, hashed_password, nome_completo, role, last_sync_timestamp FROM usuarios WHERE username = ?",
+            (username,), fetch_mode="one"
+        )
 
+    @_cached_local_read
     def listar_clientes_local(self, colaborador_username=None, tipos_filter=None):
          """
          Lists clients from local cache.
          Optionally filtered by assignment to a collaborator and/or by client types.
          """
-         query_parts = ["SELECT DISTINCT c.id, c.nome, c.tipo FROM clientes c"] # Use DISTINCT in case of multiple assignments
          params = []
-
          if colaborador_username:
-             query_parts.append("JOIN colaborador_cliente ca ON c.id = ca.cliente_id COLLATE NOCASE") # Using nome for join as in original
-             # Consider changing colaborador_cliente to use cliente_id in the future
-             query_parts.append("WHERE ca.colaborador_username = ? COLLATE NOCASE")
              params.append(colaborador_username)
-         
+
+         n_tipos = 0
          if tipos_filter and "Todos" not in tipos_filter and tipos_filter != "Todos": # Handle single string "Todos" or list
             if isinstance(tipos_filter, str): # Single type selected
                 tipos_filter = [tipos_filter]
             if isinstance(tipos_filter, list) and tipos_filter: # List of types
-                placeholders = ','.join('?' * len(tipos_filter))
-                if "WHERE" not in " ".join(query_parts):
-                    query_parts.append(f"WHERE c.tipo IN ({placeholders})")
-                else:
-                    query_parts.append(f"AND c.tipo IN ({placeholders})")
+                n_tipos = len(tipos_filter)
                 params.extend(tipos_filter)
 
-         query_parts.append("ORDER BY c.nome")
-         query = " ".join(query_parts)
+         query = _listar_clientes_sql(bool(colaborador_username), n_tipos)
          return self._execute_local_sql(query, tuple(params))
 
 
+    @_cached_local_read
     def listar_colaboradores_local(self):
         """Lists all 'Usuario' role users from local cache."""
         return self._execute_local_sql("SELECT username, nome_completo FROM usuarios WHERE role = 'Usuario' ORDER BY nome_completo")
 
 
-    def get_kpi_data_local(self, colaborador_username=None, cliente_id=None, periodo_dias=None, tipos_cliente_filter=None):
-         """Calculates KPIs based on the local 'documentos' table, with more filters."""
-         base_query = """
-            SELECT d.status, COUNT(d.id) as count 
-            FROM documentos d
+    @_cached_local_read
+    def get_dashboard_snapshot_local(self, colaborador_username=None, cliente_id=None, periodo_dias=None, tipos_cliente_filter=None,
+                                     cliente_id_nocase=False):
          """
-         params = []
-         conditions = []
-
+         Single grouped scan of the local 'documentos' table feeding both the KPI cards and the
+         'Análise por Cliente' charts. Returns {'kpi': ..., 'analise': ...} in the shapes of
+         get_kpi_data_local and get_analise_cliente_data_local.
+         """
+         criterios = tuple(config.CRITERIA_COLORS.keys())
+         params = [*_KPI_STATUS_SLOTS.keys(), *criterios] # SELECT-list parameters come first
+         n_tipos = 0
          if tipos_cliente_filter and "Todos" not in tipos_cliente_filter and tipos_cliente_filter:
-             base_query += " JOIN clientes c ON d.cliente_id = c.id "
              if isinstance(tipos_cliente_filter, str): # Single type
                  tipos_cliente_filter = [tipos_cliente_filter]
-             placeholders = ','.join('?'*len(tipos_cliente_filter))
-             conditions.append(f"c.tipo IN ({placeholders})")
+             n_tipos = len(tipos_cliente_filter)
              params.extend(tipos_cliente_filter)
 
          if colaborador_username:
-              conditions.append("d.colaborador_username = ? COLLATE NOCASE")
               params.append(colaborador_username)
          if cliente_id: # Assuming cliente_id is passed now
-              conditions.append("d.cliente_id = ?")
               params.append(cliente_id)
          
+         cutoff_iso = None
          if periodo_dias:
              try:
                 cutoff_date = datetime.now() - pd.Timedelta(days=periodo_dias) 
-                cutoff_iso = cutoff_date.isoformat()
-                conditions.append("d.data_registro >= ?")
+                cutoff_iso = cutoff_date.date().isoformat() # data_registro is stored as 'YYYY-MM-DD'
                 params.append(cutoff_iso)
              except Exception as e:
-                print(f"Warning: Could not apply date filter (days={periodo_dias}): {e}")
-        
-         if conditions:
-             base_query += " WHERE " + " AND ".join(conditions)
+                logger.warning(f"Could not apply date filter (days={periodo_dias}): {e}")
 
-         query = f"{base_query} GROUP BY d.status"
-         results = self._execute_local_sql(query, tuple(params) if params else None)
+         query = _dashboard_snapshot_sql(n_tipos, bool(colaborador_username), bool(cliente_id), cutoff_iso is not None, len(criterios),
+                                         cliente_nocase=bool(cliente_id_nocase))
+         row = self._execute_local_sql(query, tuple(params), fetch_mode="one")
 
-         kpi = {'docs_enviados': 0, 'docs_validados': 0, 'docs_invalidos': 0}
-         
-         if results:
-             status_map = {
-                  'Cadastrado': 'docs_enviados',
-                  'Validado': 'docs_validados',
-                  'Inválido': 'docs_invalidos'
-             }
-             for row in results:
-                  status_from_db = row['status']
-                  count = row['count']
-                  if status_from_db in status_map:
-                       kpi_key = status_map[status_from_db]
-                       kpi[kpi_key] += count
-         return kpi
+         if row is None: # Query error (already logged)
+              kpi = {slot: 0 for slot in _KPI_STATUS_SLOTS.values()}
+              criterios_counts = {crit: 0 for crit in criterios}
+              total_documentos = 0
+         else:
+              kpi = {slot: row[slot] for slot in _KPI_STATUS_SLOTS.values()}
+              criterios_counts = {crit: row[f"crit_{i}"] for i, crit in enumerate(criterios)} # Only 'Validado' docs
+              total_documentos = row['total_documentos']
+
+         analise = {
+             'total_documentos_cliente': total_documentos,
+             'docs_validados': kpi['docs_validados'],
+             'docs_invalidos': total_documentos - kpi['docs_validados'], # Anything not validated, named for the UI
+             'criterios_counts': criterios_counts
+         }
+         return {'kpi': kpi, 'analise': analise}
+
+    def get_kpi_data_local(self, colaborador_username=None, cliente_id=None, periodo_dias=None, tipos_cliente_filter=None):
+         """Calculates KPIs based on the local 'documentos' table, with more filters."""
+         return self.get_dashboard_snapshot_local(colaborador_username, cliente_id, periodo_dias, tipos_cliente_filter)['kpi']
 
 
     def get_criterios_atendidos_cliente_local(self, cliente_id): # Changed to cliente_id
@@ -462,75 +897,73 @@ class HybridDBManager:
                      crit_data[tipo]['atendidos'] = row['docs_validados'] or 0
         return crit_data
 
+    @_cached_local_read
     def calcular_pontuacao_colaboradores_local(self):
         """Calculates collaborator scores based on local SQLite data."""
+        # Validated links are counted in one pass over idx_docs_colab_status, then joined to the users;
+        # NOCASE like every other colaborador_username filter in this module
         query = """
+            WITH validados AS (
+                SELECT colaborador_username COLLATE NOCASE AS colaborador, COUNT(*) AS n
+                FROM documentos
+                WHERE status = 'Validado'
+                GROUP BY 1
+            )
             SELECT
-                u.nome_completo,
-                COALESCE(SUM(CASE WHEN d.status = 'Validado' THEN 1 ELSE 0 END), 0) as links_validados,
-                (SELECT COUNT(*) FROM documentos d2 WHERE d2.colaborador_username = u.username) as total_links_colab,
-                COALESCE(SUM(CASE WHEN d.status = 'Validado' THEN 1 ELSE 0 END), 0) * 10 as pontuacao 
+                u.nome_completo AS "Colaborador",
+                COALESCE(v.n, 0) AS "Links Validados"
             FROM usuarios u
-            LEFT JOIN documentos d ON u.username = d.colaborador_username 
+            LEFT JOIN validados v ON v.colaborador = u.username COLLATE NOCASE
             WHERE u.role = 'Usuario'
-            GROUP BY u.username, u.nome_completo
-            ORDER BY pontuacao DESC, u.nome_completo ASC
-        """ # Score based on all docs, validated or not, then sum validated for links_validados
-        results = self._execute_local_sql(query)
-        if not results:
+            ORDER BY 2 DESC, 1 ASC
+        """
+        try:
+            with self._lock:
+                df = pd.read_sql_query(query, self.local_conn)
+        except Exception as e:
+            logger.error(f"Error calculating local collaborator scores: {e}")
+            df = pd.DataFrame()
+        if df.empty:
              return pd.DataFrame({'Colaborador': [], 'Pontuação': [], 'Links Validados': [], 'Percentual': []})
 
-        df = pd.DataFrame([dict(row) for row in results])
-        df['links_validados'] = df['links_validados'].astype(int) # Ensure it's int
-        df['pontuacao'] = df['links_validados'] # Pontuação is just count of validated links
+        df['Links Validados'] = df['Links Validados'].astype(int)
+        df['Pontuação'] = df['Links Validados'] # Pontuação is just count of validated links
 
-        total_validados_geral = df['links_validados'].sum()
-        df['Percentual'] = (df['links_validados'] / total_validados_geral * 100) if total_validados_geral > 0 else 0.0
-        
-        df_display = df[['nome_completo', 'pontuacao', 'links_validados', 'Percentual']].rename(columns={
-            'nome_completo': 'Colaborador',
-            'pontuacao': 'Pontuação',
-            'links_validados': 'Links Validados'
-        })
-        
-        return df_display.set_index('Colaborador')
+        total_validados_geral = df['Links Validados'].sum()
+        df['Percentual'] = (df['Links Validados'] / total_validados_geral * 100) if total_validados_geral > 0 else 0.0
+
+        return df[['Colaborador', 'Pontuação', 'Links Validados', 'Percentual']].set_index('Colaborador')
     
     def get_docs_por_periodo_cliente_local(self, cliente_id, grupo='W'): # Changed to cliente_id
         """Gets validated docs count per period for a client (by ID) from local data."""
-        format_map = {'W': '%Y-%W', 'D': '%Y-%m-%d', 'M': '%Y-%m'}
-        sql_format = format_map.get(grupo, '%Y-%W')
+        # SQLite emits the ISO start date of each bucket directly (week starts on Monday)
+        bucket_map = {
+            'W': "date(data_registro, 'weekday 0', '-6 days')",
+            'D': "date(data_registro)",
+            'M': "date(data_registro, 'start of month')"
+        }
+        bucket_sql = bucket_map.get(grupo, bucket_map['W'])
 
         query = f"""
             SELECT
-                strftime('{sql_format}', data_registro) as periodo,
-                COUNT(id) as contagem
+                {bucket_sql} as periodo,
+                COUNT(*) as contagem -- COUNT(*) keeps the scan inside idx_docs_cliente_status (covering)
             FROM documentos
             WHERE cliente_id = ? AND status = 'Validado' AND data_registro IS NOT NULL AND data_registro != ''
             GROUP BY periodo
             HAVING periodo IS NOT NULL
-            ORDER BY MIN(data_registro) ASC 
+            ORDER BY periodo ASC
         """
-        results = self._execute_local_sql(query, (cliente_id,))
-        if not results:
-            return pd.DataFrame({'periodo': [], 'contagem': [], 'periodo_dt': []})
-        
-        df = pd.DataFrame([dict(row) for row in results])
-        
         try:
-            if grupo == 'W':
-                 df['periodo_dt'] = pd.to_datetime(df['periodo'] + '-1', format='%Y-%W-%w', errors='coerce')
-            elif grupo == 'M':
-                 df['periodo_dt'] = pd.to_datetime(df['periodo'] + '-01', format='%Y-%m-%d', errors='coerce') # Explicit day
-            else: # 'D'
-                 df['periodo_dt'] = pd.to_datetime(df['periodo'], format='%Y-%m-%d', errors='coerce')
-            
-            df.dropna(subset=['periodo_dt'], inplace=True)
-            df.sort_values('periodo_dt', inplace=True)
-
-        except Exception as e_pd:
-             print(f"Error converting period string to datetime for cliente_id {cliente_id}: {e_pd}. Data: {df['periodo'].unique()}")
-             return df[['periodo', 'contagem']]
+            with self._lock:
+                df = pd.read_sql_query(query, self.local_conn, params=(cliente_id,))
+        except Exception as e:
+            logger.error(f"Error fetching docs per period for cliente_id {cliente_id}: {e}")
+            df = pd.DataFrame()
+        if df.empty:
+            return pd.DataFrame({'periodo': [], 'contagem': [], 'periodo_dt': []})
 
+        df['periodo_dt'] = pd.to_datetime(df['periodo'], format='%Y-%m-%d')
         return df[['periodo', 'contagem', 'periodo_dt']]
     
     def get_documentos_usuario_local(self, username, synced_status=None, tipos_cliente_filter=None):
@@ -540,7 +973,7 @@ class HybridDBManager:
         conditions = ["d.colaborador_username = ? COLLATE NOCASE"]
         params.append(username)
 
-        if synced_status is not None and synced_status in [0, 1]:
+        if synced_status is not None and synced_status in (0, 1):
             conditions.append("d.is_synced = ?")
             params.append(synced_status)
 
@@ -548,7 +981,7 @@ class HybridDBManager:
             query_parts.append("JOIN clientes c ON d.cliente_id = c.id")
             if isinstance(tipos_cliente_filter, str):
                 tipos_cliente_filter = [tipos_cliente_filter]
-            placeholders = ','.join('?' * len(tipos_cliente_filter))
+            placeholders = _placeholders(len(tipos_cliente_filter))
             conditions.append(f"c.tipo IN ({placeholders})")
             params.extend(tipos_cliente_filter)
         
@@ -585,7 +1018,7 @@ class HybridDBManager:
             # No need to join again if already joined, but ensure 'c.tipo' is used
             if isinstance(tipos_cliente_filter, str):
                 tipos_cliente_filter = [tipos_cliente_filter]
-            placeholders = ','.join('?' * len(tipos_cliente_filter))
+            placeholders = _placeholders(len(tipos_cliente_filter))
             conditions.append(f"c.tipo IN ({placeholders})")
             params.extend(tipos_cliente_filter)
 
@@ -599,6 +1032,36 @@ class HybridDBManager:
         return [dict(row) for row in results] if results else []
 
 
+    def _count_validated_in_sheets(self, sheet_names):
+        """
+        Counts 'Validado' rows per user document sheet with two values.batchGet calls in total:
+        one for the header rows (to locate 'status' in each sheet) and one for the status columns only.
+        Returns {sheet_name: count} for the sheets that exist and have a 'status' column.
+        """
+        existing = [name for name in sheet_names if self._get_worksheet(name)]
+        if not existing:
+            return {}
+        headers = self.spreadsheet.values_batch_get(ranges=[f"{_a1_sheet(name)}!1:1" for name in existing])
+
+        status_ranges = {}
+        for name, value_range in zip(existing, headers.get('valueRanges', [])):
+            header = (value_range.get('values') or [[]])[0]
+            if 'status' not in header:
+                logger.warning(f"Planilha '{name}' sem coluna 'status'; ignorada no cálculo de pontuação.")
+                continue
+            col_letter = _col_letter(header.index('status') + 1)
+            status_ranges[name] = f"{_a1_sheet(name)}!{col_letter}2:{col_letter}"
+        if not status_ranges:
+            return {}
+
+        response = self.spreadsheet.values_batch_get(ranges=list(status_ranges.values()))
+        counts = {}
+        for name, value_range in zip(status_ranges, response.get('valueRanges', [])):
+            # Each row is a 1-cell list ([] for blank cells); .str[0] unwraps them vectorized (blank -> NaN)
+            statuses = pd.Series(value_range.get('values', []), dtype=object).str[0]
+            counts[name] = int(statuses.str.strip().str.lower().eq('validado').sum())
+        return counts
+
     @st.cache_data(ttl=300) 
     def calcular_pontuacao_colaboradores_gsheet(_self):
         """
@@ -606,7 +1069,7 @@ class HybridDBManager:
         lendo DIRETAMENTE das planilhas Google Sheets relevantes.
         AVISO: Esta função pode ser lenta devido a múltiplas chamadas de API.
         """
-        print("Calculando pontuação de colaboradores diretamente do Google Sheets (pode ser lento)...")
+        logger.info("Calculando pontuação de colaboradores diretamente do Google Sheets (pode ser lento)...")
         df_pontuacao_final = pd.DataFrame({
             'Colaborador': [], 'Pontuação': [], 'Links Validados': [], 'Percentual': []
         }).set_index('Colaborador')
@@ -624,31 +1087,18 @@ class HybridDBManager:
             ]
 
             if not colaboradores_info:
-                print("Nenhum usuário com perfil 'Usuario' encontrado na planilha.")
+                logger.info("Nenhum usuário com perfil 'Usuario' encontrado na planilha.")
                 return df_pontuacao_final
 
-            validated_counts = {} 
-            total_validated_overall = 0
-
-            print(f"Encontrados {len(colaboradores_info)} colaboradores. Buscando documentos validados...")
-            for user_info in colaboradores_info:
-                username = user_info['username']
-                sheet_name = _self._get_user_sheet_name(username)
-                user_validated_count = 0
-                try:
-                    docs_ws = _self._get_worksheet(sheet_name) 
-                    if docs_ws:
-                        docs_data = docs_ws.get_all_records() # Might be slow for large sheets
-                        for record in docs_data:
-                            status = str(record.get('status', '')).strip().lower()
-                            if status == 'validado': 
-                                user_validated_count += 1
-                    # else: # Sheet not found for user, count remains 0
-                        # print(f"  - Usuário '{username}': Planilha '{sheet_name}' não encontrada ou vazia.")
-                except Exception as e:
-                     print(f"  - Erro ao processar planilha '{sheet_name}' para usuário '{username}': {e}")
-                validated_counts[username] = user_validated_count
-                total_validated_overall += user_validated_count
+            logger.info(f"Encontrados {len(colaboradores_info)} colaboradores. Buscando documentos validados...")
+            validated_by_sheet = _self._count_validated_in_sheets(
+                [_self._get_user_sheet_name(u['username']) for u in colaboradores_info]
+            )
+            validated_counts = {
+                u['username']: validated_by_sheet.get(_self._get_user_sheet_name(u['username']), 0) # Sheet missing -> 0
+                for u in colaboradores_info
+            }
+            total_validated_overall = sum(validated_counts.values())
             
             result_data = []
             for user_info in colaboradores_info:
@@ -670,7 +1120,7 @@ class HybridDBManager:
              st.error(f"Erro de API do Google ao calcular pontuação GSheet: {api_err}")
         except Exception as e:
              st.error(f"Erro inesperado ao calcular pontuação GSheet: {e}")
-             import traceback; traceback.print_exc()
+             logger.exception("Erro inesperado ao calcular pontuação GSheet")
         return df_pontuacao_final
 
     # --- Local Write Methods ---
@@ -682,52 +1132,92 @@ class HybridDBManager:
         doc_data is a dictionary matching the table columns.
         Returns (True, "SUCCESS") on success, (False, "ERROR_MESSAGE") or (False, "DUPLICATE") on failure.
         """
-        if not doc_data.get("id"):
-            doc_data["id"] = str(uuid.uuid4())
-
-        # --- Verificação de Duplicidade ---
-        check_query = """
-            SELECT id FROM documentos
-            WHERE colaborador_username = ?
-            AND cliente_id = ?
-            AND dimensao_criterio = ?
-            AND link_ou_documento = ?
-        """
-        existing_doc = self._execute_local_sql(
-            check_query,
-            (
-                doc_data.get("colaborador_username"),
-                doc_data.get("cliente_id"),
-                doc_data.get("dimensao_criterio"),
-                doc_data.get("link_ou_documento"),
-            ),
-            fetch_mode="one",
-        )
+        # Same duplicate check / transaction / error mapping as a batch of one
+        return self.add_documentos_local_bulk([doc_data])[0]
 
-        if existing_doc:
-            print(f"Tentativa de adicionar documento duplicado: {doc_data.get('link_ou_documento')} para cliente ID {doc_data.get('cliente_id')}")
-            return False, "DUPLICATE" # Retorna tupla
-        # --- Fim da Verificação de Duplicidade ---
 
-        cols = list(doc_data.keys())
-        placeholders = ", ".join(["?"] * len(cols))
-        columns_quoted = [f'"{c}"' for c in cols]
-        columns_str = ", ".join(columns_quoted)
-        query = f'INSERT INTO documentos ({columns_str}) VALUES ({placeholders})'
+    def add_documentos_local_bulk(self, docs_data):
+        """
+        Adds several document records to the local 'documentos' table in one transaction (executemany).
+        Ids are generated when missing and duplicates (same colaborador, cliente_id, dimensão and link,
+        also within the batch) are skipped.
+        Returns a list of (success, message) tuples in input order: (True, "SUCCESS"), (False, "DUPLICATE"),
+        (False, "DB_INTEGRITY_ERROR: ..."), (False, "DB_ERROR: ...") or (False, "UNEXPECTED_ERROR: ...").
+        The caller's dicts are not modified.
+        """
+        if not docs_data:
+            return []
         try:
-            self._execute_local_sql(query, list(doc_data.values()), fetch_mode=None)
-            self.local_conn.commit()
-            # print(f"Documento {doc_data.get('id')} adicionado localmente com sucesso.")
-            return True, "SUCCESS" # Retorna tupla
-        except sqlite3.IntegrityError as e:
-            print(f"Erro de integridade SQLite ao adicionar documento local: {e}. Dados: {doc_data}")
-            return False, f"DB_INTEGRITY_ERROR: {e}" # Retorna tupla
-        except sqlite3.Error as e:
-            print(f"Erro SQLite ao adicionar documento local: {e}. Dados: {doc_data}")
-            return False, f"DB_ERROR: {e}" # Retorna tupla
+            return self._add_documentos_local_bulk(docs_data)
         except Exception as e:
-            print(f"Erro inesperado ao adicionar documento local: {e}. Dados: {doc_data}")
-            return False, f"UNEXPECTED_ERROR: {e}" # Retorna tupla
+            logger.error(f"Erro inesperado ao adicionar documentos locais: {e}")
+            return [(False, f"UNEXPECTED_ERROR: {e}")] * len(docs_data)
+
+    def _add_documentos_local_bulk(self, docs_data):
+        """Body of add_documentos_local_bulk; sqlite errors are mapped per row here."""
+        results = [None] * len(docs_data)
+        docs_data = [dict(doc_data, id=doc_data.get("id") or str(uuid.uuid4())) for doc_data in docs_data]
+
+        cols = list(docs_data[0].keys())
+        columns_str = ", ".join(f'"{c}"' for c in cols)
+        insert_query = f'INSERT INTO documentos ({columns_str}) VALUES ({", ".join(["?"] * len(cols))})'
+        dup_keys = [
+            (d.get("colaborador_username"), d.get("cliente_id"), d.get("dimensao_criterio"), d.get("link_ou_documento"))
+            for d in docs_data
+        ]
+        # Links agrupados por (colaborador, cliente_id, dimensão): uma consulta IN por grupo em vez de uma por linha
+        links_by_group = {}
+        for key in dup_keys:
+            links_by_group.setdefault(key[:3], set()).add(key[3])
+
+        with self._lock:
+            seen_keys = set() # Chaves já existentes no banco + as já aceitas neste lote
+            for group, links in links_by_group.items():
+                links = list(links)
+                for chunk in _in_chunks(links):
+                    rows = self.local_conn.execute(f"""
+                        SELECT link_ou_documento FROM documentos
+                        WHERE colaborador_username = ?
+                        AND cliente_id = ?
+                        AND dimensao_criterio = ?
+                        AND link_ou_documento IN ({_placeholders(len(chunk))})
+                    """, (*group, *chunk))
+                    seen_keys.update((*group, row[0]) for row in rows)
+
+            to_insert = [] # (position in docs_data, row values)
+            for pos, (doc_data, dup_key) in enumerate(zip(docs_data, dup_keys)):
+                if dup_key in seen_keys:
+                    logger.debug(f"Tentativa de adicionar documento duplicado: {dup_key[3]} para cliente ID {dup_key[1]}")
+                    results[pos] = (False, "DUPLICATE")
+                    continue
+                seen_keys.add(dup_key)
+                to_insert.append((pos, [doc_data.get(c) for c in cols]))
+
+            if to_insert:
+                try:
+                    with self._local_transaction() as conn:
+                        conn.executemany(insert_query, [row for _, row in to_insert])
+                    for pos, _ in to_insert:
+                        results[pos] = (True, "SUCCESS")
+                except sqlite3.IntegrityError as e:
+                    # The batch was rolled back; insert row by row so only the offending rows fail
+                    logger.warning(f"Erro de integridade no lote ({e}); inserindo documentos um a um.")
+                    for pos, row in to_insert:
+                        try:
+                            with self._local_transaction() as conn:
+                                conn.execute(insert_query, row)
+                            results[pos] = (True, "SUCCESS")
+                        except sqlite3.IntegrityError as e_row:
+                            logger.error(f"Erro de integridade SQLite ao adicionar documento local: {e_row}. Dados: {docs_data[pos]}")
+                            results[pos] = (False, f"DB_INTEGRITY_ERROR: {e_row}")
+                        except sqlite3.Error as e_row:
+                            logger.error(f"Erro SQLite ao adicionar documento local: {e_row}. Dados: {docs_data[pos]}")
+                            results[pos] = (False, f"DB_ERROR: {e_row}")
+                except sqlite3.Error as e:
+                    logger.error(f"Erro SQLite ao adicionar documentos locais: {e}")
+                    for pos, _ in to_insert:
+                        results[pos] = (False, f"DB_ERROR: {e}")
+        return results
 
 
     def save_selected_docs_to_sheets(self, username, list_of_doc_ids):
@@ -737,66 +1227,77 @@ class HybridDBManager:
              return False
 
         user_sheet_name = self._get_user_sheet_name(username)
-        print(f"Iniciando salvamento seletivo (append) para '{username}' na planilha '{user_sheet_name}'...")
-
-        placeholders = ','.join('?' * len(list_of_doc_ids))
-        cols_to_select_str = ", ".join([f'"{col}"' for col in config.DOCS_COLS]) 
-        query = f"""
-            SELECT {cols_to_select_str}
-            FROM documentos
-            WHERE colaborador_username = ? COLLATE NOCASE AND id IN ({placeholders}) AND is_synced = 0
-        """
-        params = tuple([username] + list_of_doc_ids)
-        docs_to_save = self._execute_local_sql(query, params)
+        logger.info(f"Iniciando salvamento seletivo (append) para '{username}' na planilha '{user_sheet_name}'...")
+
+        docs_to_save = []
+        for chunk in _in_chunks(list(list_of_doc_ids)):
+            query = f"""
+                SELECT {_UPLOAD_DOCS_COLUMNS}
+                FROM documentos d
+                WHERE d.colaborador_username = ? COLLATE NOCASE AND d.id IN ({_placeholders(len(chunk))}) AND d.is_synced = 0
+            """
+            docs_to_save.extend(self._execute_local_sql(query, tuple([username] + chunk)) or [])
 
         if not docs_to_save:
              st.error("Não foi possível encontrar os documentos selecionados não sincronizados no cache local.")
              return False
 
-        data_to_append = []
-        saved_ids_confirm = []
-        for row_sqlite in docs_to_save:
-            row_dict = dict(row_sqlite)
-            # Ensure cliente_id is present, try to fetch if missing (should be rare here if add_documento_local worked)
-            if not row_dict.get('cliente_id') and row_dict.get('cliente_nome'):
-                 client_obj = self._execute_local_sql("SELECT id FROM clientes WHERE nome = ? COLLATE NOCASE", (row_dict['cliente_nome'],), fetch_mode="one")
-                 if client_obj: row_dict['cliente_id'] = client_obj['id']
-
-            ordered_row_values = [str(row_dict.get(col, '')) for col in config.DOCS_COLS]
-            data_to_append.append(ordered_row_values)
-            saved_ids_confirm.append(row_dict.get('id'))
+        # The SELECT returns config.DOCS_COLS in order with cliente_id already resolved, so each sqlite3.Row
+        # becomes the sheet row directly
+        id_pos = config.DOCS_COL_IDX['id']
+        data_to_append = [[str(value) for value in row_sqlite] for row_sqlite in docs_to_save]
+        saved_ids_confirm = [row_sqlite[id_pos] for row_sqlite in docs_to_save]
 
         if not data_to_append:
             st.error("Falha ao preparar dados para envio (nenhum dado para anexar).")
             return False
 
         ws = self._get_worksheet(user_sheet_name)
+        sheet_created = False
         if not ws:
             # Try to create the sheet if it doesn't exist
-            print(f"Planilha '{user_sheet_name}' não encontrada. Tentando criar...")
+            logger.info(f"Planilha '{user_sheet_name}' não encontrada. Tentando criar...")
             try:
                 ws = self.spreadsheet.add_worksheet(title=user_sheet_name, rows=max(100, len(data_to_append) + 20), cols=len(config.DOCS_COLS))
-                ws.update([config.DOCS_COLS], value_input_option='USER_ENTERED') # Write header
-                print(f"Planilha '{user_sheet_name}' criada com sucesso.")
+                self._worksheet_cache[user_sheet_name] = ws
+                sheet_created = True
+                logger.info(f"Planilha '{user_sheet_name}' criada com sucesso.")
             except Exception as create_e:
                 st.error(f"Falha ao criar planilha '{user_sheet_name}': {create_e}")
                 return False
         try:
-             print(f"Anexando {len(data_to_append)} registros na planilha '{user_sheet_name}'...")
-             ws.append_rows(data_to_append, value_input_option='USER_ENTERED', insert_data_option='INSERT_ROWS', table_range='A1')
-             print("Registros anexados com sucesso na planilha.")
+             logger.info(f"Anexando {len(data_to_append)} registros na planilha '{user_sheet_name}'...")
+             sync_time_handled = sheet_created
+             if sheet_created:
+                 # Empty new sheet: header, rows and the user's last_sync_timestamp go in one values batchUpdate
+                 self._write_values_with_sync_time(username, [{
+                     'range': gspread.utils.absolute_range_name(user_sheet_name, 'A1'),
+                     'values': [list(config.DOCS_COLS)] + data_to_append
+                 }])
+             else: # The append endpoint can't share a request with a values update, so the timestamp follows separately
+                 _sheets_call(ws.append_rows, data_to_append, value_input_option='USER_ENTERED', insert_data_option='INSERT_ROWS', table_range='A1',
+                              retry_server_errors=False)
+             logger.info("Registros anexados com sucesso na planilha.")
 
              if saved_ids_confirm:
-                 placeholders_update = ','.join('?' * len(saved_ids_confirm))
-                 update_query = f"UPDATE documentos SET is_synced = 1 WHERE id IN ({placeholders_update}) AND colaborador_username = ?"
-                 update_params = tuple(saved_ids_confirm + [username])
-                 rows_updated = self._execute_local_sql(update_query, update_params, fetch_mode=None)
-                 print(f"{rows_updated} registros marcados como sincronizados localmente.")
+                 # Mark as synced and check for leftovers in the same transaction; only existence matters for the flag
+                 with self._local_transaction() as conn:
+                      rows_updated = 0
+                      for chunk in _in_chunks(saved_ids_confirm):
+                           rows_updated += conn.execute(
+                               f"UPDATE documentos SET is_synced = 1 WHERE id IN ({_placeholders(len(chunk))}) AND colaborador_username = ?",
+                               tuple(chunk + [username])
+                           ).rowcount
+                      remaining_unsaved = conn.execute(
+                          "SELECT 1 FROM documentos WHERE colaborador_username = ? COLLATE NOCASE AND is_synced = 0 LIMIT 1",
+                          (username,)
+                      ).fetchone() is not None
+                 logger.info(f"{rows_updated} registros marcados como sincronizados localmente.")
                  if rows_updated != len(saved_ids_confirm):
                       st.warning("Contagem de registros marcados localmente não bate com a contagem enviada.")
-                 self._update_last_sync_time_gsheet(username)
-                 remaining_unsaved = self.get_unsynced_documents_local(username)
-                 st.session_state['unsaved_changes'] = bool(remaining_unsaved)
+                 if not sync_time_handled:
+                      self._update_last_sync_time_gsheet(username)
+                 st.session_state['unsaved_changes'] = remaining_unsaved
                  return True
              else: # Should not happen if docs_to_save was populated
                  st.warning("Nenhum ID confirmado para marcar como sincronizado localmente.")
@@ -805,24 +1306,59 @@ class HybridDBManager:
              st.error(f"Falha ao anexar dados na planilha '{user_sheet_name}': {append_e}")
              return False
 
-    def _update_last_sync_time_gsheet(self, username):
+    def _index_user_rows(self, users_values):
+        """Rebuilds the username -> sheet row map from the users sheet values read during the session load."""
+        self._user_row_index = {}
+        if not users_values or 'username' not in users_values[0]:
+            return
+        username_pos = users_values[0].index('username')
+        for row_number, row in enumerate(users_values[1:], start=2):
+            self._user_row_index.setdefault(str(row[username_pos]).strip().lower(), row_number) # First match, like find()
+
+    def _last_sync_time_entry(self, username):
+        """
+        Builds the values_batch_update entry for the user's 'last_sync_timestamp' cell.
+        Returns (entry, now_str), or None when the sheet, column or user row can't be found.
+        """
         users_ws = self._get_worksheet(config.SHEET_USERS)
         if not users_ws:
             st.error("Planilha 'usuarios' não encontrada para atualizar timestamp.")
+            return None
+        if 'last_sync_timestamp' not in config.USERS_COL_IDX:
+             st.error("Coluna 'last_sync_timestamp' não definida em config.USERS_COLS.")
+             return None
+        user_row_index = self._user_row_index.get(str(username).strip().lower())
+        if user_row_index is None: # Not in the map (e.g. loaded without the batch read): search the column once
+            cell = users_ws.find(username, in_column=config.USERS_COL_IDX['username'] + 1)
+            if not cell: return None
+            user_row_index = cell.row
+            self._user_row_index[str(username).strip().lower()] = user_row_index
+        timestamp_letter = _col_letter(config.USERS_COL_IDX['last_sync_timestamp'] + 1)
+        now_str = datetime.now().isoformat(sep=' ', timespec='seconds')
+        entry = {
+            'range': gspread.utils.absolute_range_name(users_ws.title, f"{timestamp_letter}{user_row_index}"),
+            'values': [[now_str]]
+        }
+        return entry, now_str
+
+    def _write_values_with_sync_time(self, username, data_entries):
+        """
+        Writes the given values_batch_update entries plus the user's last_sync_timestamp in one request,
+        then mirrors the timestamp locally. Without a timestamp entry the data is still written.
+        Returns True when the timestamp was written as well.
+        """
+        sync_entry = self._last_sync_time_entry(username)
+        entries = list(data_entries) + ([sync_entry[0]] if sync_entry else [])
+        if entries:
+            _sheets_call(self.spreadsheet.values_batch_update, {'valueInputOption': 'USER_ENTERED', 'data': entries})
+        if not sync_entry:
             return False
+        self._execute_local_sql("UPDATE usuarios SET last_sync_timestamp = ? WHERE username = ?", (sync_entry[1], username), fetch_mode=None)
+        return True
+
+    def _update_last_sync_time_gsheet(self, username):
         try:
-            cell = users_ws.find(username, in_column=config.USERS_COLS.index('username') + 1)
-            if not cell: return False 
-            user_row_index = cell.row
-            try:
-                 timestamp_col_index = config.USERS_COLS.index('last_sync_timestamp') + 1
-            except ValueError:
-                 st.error("Coluna 'last_sync_timestamp' não definida em config.USERS_COLS.")
-                 return False
-            now_str = datetime.now().isoformat(sep=' ', timespec='seconds')
-            users_ws.update_cell(user_row_index, timestamp_col_index, now_str)
-            self._execute_local_sql("UPDATE usuarios SET last_sync_timestamp = ? WHERE username = ?", (now_str, username), fetch_mode=None)
-            return True
+            return self._write_values_with_sync_time(username, [])
         except Exception as e:
             st.error(f"Erro ao atualizar timestamp para {username}: {e}")
             return False
@@ -832,86 +1368,129 @@ class HybridDBManager:
         Updates the status, validation date, and validator for a specific document
         both in the corresponding Google Sheet and the local cache.
         """
-        print(f"Attempting to update doc_id '{doc_id}' to status '{new_status}' by '{admin_username}'...")
-        local_doc = self._execute_local_sql("SELECT colaborador_username, cliente_id FROM documentos WHERE id = ?", (doc_id,), fetch_mode="one")
-        if not local_doc:
-             st.error(f"Documento com ID '{doc_id}' não encontrado localmente.")
-             return False
-
-        colaborador_username = local_doc['colaborador_username']
-        # cliente_id_from_doc = local_doc['cliente_id'] # May need this if GSheet doesn't have cliente_id
-        user_sheet_name = self._get_user_sheet_name(colaborador_username)
-
-        ws = self._get_worksheet(user_sheet_name)
-        if not ws:
-             st.error(f"Planilha '{user_sheet_name}' para o colaborador '{colaborador_username}' não encontrada.")
-             return False
-        try:
-            id_col_gvar = 'id' # Name of ID col in GSheet
-            header_values = ws.row_values(1) # Get header row
-            if id_col_gvar not in header_values:
-                st.error(f"Coluna '{id_col_gvar}' não encontrada no cabeçalho da planilha '{user_sheet_name}'.")
-                return False
-            id_col_index_gsheet = header_values.index(id_col_gvar) + 1
-            
-            cell = ws.find(doc_id, in_column=id_col_index_gsheet)
-            if not cell:
-                 st.error(f"Documento com ID '{doc_id}' não encontrado na planilha '{user_sheet_name}'.")
-                 return False
-            row_index = cell.row
-            print(f"Found doc_id '{doc_id}' in sheet '{user_sheet_name}' at row {row_index}.")
-
-            # Update GSheet columns based on their names in config.DOCS_COLS
-            updates_batch = []
-            now_str = datetime.now().isoformat(sep=' ', timespec='seconds')
-            update_map = {
-                'status': new_status,
-                'data_validacao': now_str,
-                'validado_por': admin_username,
-                'observacoes_validacao': observacoes
-            }
-
-            for col_name, value_to_set in update_map.items():
-                if col_name in header_values:
-                    col_idx_gsheet = header_values.index(col_name) + 1
-                    updates_batch.append({
-                        'range': gspread.utils.rowcol_to_a1(row_index, col_idx_gsheet),
-                        'values': [[value_to_set]]
-                    })
-                else:
-                    print(f"Aviso: Coluna '{col_name}' não encontrada na planilha '{user_sheet_name}' durante a atualização do status.")
+        updated_ids, _ = self.update_documents_status_gsheet_and_local(
+            [(doc_id, new_status, observacoes)], admin_username
+        )
+        return doc_id in updated_ids
 
-            if updates_batch:
-                ws.batch_update(updates_batch, value_input_option='USER_ENTERED')
-                print(f"GSheet row {row_index} updated (or attempted).")
+    def update_documents_status_gsheet_and_local(self, updates, admin_username):
+        """
+        Batch version of update_document_status_gsheet_and_local.
+        `updates` is a list of (doc_id, new_status, observacoes). Each collaborator sheet gets one
+        header read, one id-column read and one batch_update; the local cache is updated in one transaction.
+        Returns (updated_ids, failed_ids).
+        """
+        updated_ids, failed_ids = [], []
+        valid_updates = []
+        for doc_id, new_status, observacoes in updates:
+            if new_status not in config.VALID_STATUS_SET: # Reject before any Sheets round-trip
+                st.error(f"Status inválido para o documento '{doc_id}': '{new_status}'.")
+                failed_ids.append(doc_id)
             else:
-                st.warning("Nenhuma coluna correspondente encontrada na planilha para atualização de status.")
-                # Still update local if no GSheet cols match? Or fail? Let's update local.
-
-            update_local_query = """
-                UPDATE documentos
-                SET status = ?, data_validacao = ?, validado_por = ?, observacoes_validacao = ?, is_synced = 1
-                WHERE id = ?
-            """
-            rows_updated = self._execute_local_sql(
-                update_local_query,
-                (new_status, now_str, admin_username, observacoes, doc_id),
-                fetch_mode=None
-            )
-            if rows_updated == 1:
-                print(f"Local document ID '{doc_id}' updated successfully.")
-                return True
-            else: # Should not happen if local_doc was found
-                st.error(f"Falha ao atualizar o registro local para o ID '{doc_id}' (linhas afetadas: {rows_updated}).")
-                return False
-        except gspread.exceptions.APIError as api_err:
-             st.error(f"Erro de API do Google ao atualizar status para doc ID '{doc_id}': {api_err}")
-        except ValueError as ve: 
-             st.error(f"Erro de configuração ou planilha: coluna não encontrada. {ve}")
-        except Exception as e:
-             st.error(f"Erro inesperado ao atualizar status para doc ID '{doc_id}': {e}")
-             import traceback; traceback.print_exc()
-        return False
+                valid_updates.append((doc_id, new_status, observacoes or ""))
+        if not valid_updates:
+            return updated_ids, failed_ids
+        logger.info(f"Attempting to update {len(valid_updates)} document(s) by '{admin_username}'...")
+
+        # Resolve the owning collaborator of every document in one local query per chunk of ids
+        doc_ids = [u[0] for u in valid_updates]
+        owner_by_id = {}
+        for chunk in _in_chunks(doc_ids):
+            owner_rows = self._execute_local_sql(
+                f"SELECT id, colaborador_username FROM documentos WHERE id IN ({_placeholders(len(chunk))})", tuple(chunk)
+            ) or []
+            owner_by_id.update((row['id'], row['colaborador_username']) for row in owner_rows)
+
+        updates_by_user = {}
+        for doc_id, new_status, observacoes in valid_updates:
+            colaborador_username = owner_by_id.get(doc_id)
+            if not colaborador_username:
+                st.error(f"Documento com ID '{doc_id}' não encontrado localmente.")
+                failed_ids.append(doc_id)
+            else:
+                updates_by_user.setdefault(colaborador_username, []).append((doc_id, new_status, observacoes))
+
+        now_str = datetime.now().isoformat(sep=' ', timespec='seconds')
+        local_updates = [] # (status, data_validacao, validado_por, observacoes, id) for docs updated on the sheet
+        for colaborador_username, user_updates in updates_by_user.items():
+            user_sheet_name = self._get_user_sheet_name(colaborador_username)
+            user_doc_ids = [u[0] for u in user_updates]
+            ws = self._get_worksheet(user_sheet_name)
+            if not ws:
+                st.error(f"Planilha '{user_sheet_name}' para o colaborador '{colaborador_username}' não encontrada.")
+                failed_ids.extend(user_doc_ids)
+                continue
+            try:
+                header_values = ws.row_values(1) # Get header row
+                header_idx = {name: i + 1 for i, name in enumerate(header_values)}
+                if 'id' not in header_idx:
+                    st.error(f"Coluna 'id' não encontrada no cabeçalho da planilha '{user_sheet_name}'.")
+                    failed_ids.extend(user_doc_ids)
+                    continue
+                # One read of the id column replaces a ws.find per document
+                sheet_ids = ws.col_values(header_idx['id'])
+                row_by_id = {}
+                for r, v in enumerate(sheet_ids[1:], start=2): # Skip header; keep first match like ws.find
+                    row_by_id.setdefault(str(v), r)
+
+                for col_name in ('status', 'data_validacao', 'validado_por', 'observacoes_validacao'):
+                    if col_name not in header_idx:
+                        logger.warning(f"Coluna '{col_name}' não encontrada na planilha '{user_sheet_name}' durante a atualização do status.")
+
+                updates_batch = []
+                sheet_updated_ids = []
+                for doc_id, new_status, observacoes in user_updates:
+                    row_index = row_by_id.get(str(doc_id))
+                    if not row_index:
+                        st.error(f"Documento com ID '{doc_id}' não encontrado na planilha '{user_sheet_name}'.")
+                        failed_ids.append(doc_id)
+                        continue
+                    update_map = {
+                        'status': new_status,
+                        'data_validacao': now_str,
+                        'validado_por': admin_username,
+                        'observacoes_validacao': observacoes
+                    }
+                    for col_name, value_to_set in update_map.items():
+                        if col_name in header_idx:
+                            updates_batch.append({
+                                'range': f"{_col_letter(header_idx[col_name])}{row_index}",
+                                'values': [[value_to_set]]
+                            })
+                    sheet_updated_ids.append(doc_id)
+                    local_updates.append((new_status, now_str, admin_username, observacoes, doc_id))
+
+                if updates_batch:
+                    _sheets_call(ws.batch_update, updates_batch, value_input_option='USER_ENTERED')
+                    logger.info(f"GSheet '{user_sheet_name}': {len(sheet_updated_ids)} row(s) updated.")
+                elif sheet_updated_ids:
+                    st.warning("Nenhuma coluna correspondente encontrada na planilha para atualização de status.")
+                    # Still update local if no GSheet cols match
+            except Exception as e:
+                if isinstance(e, gspread.exceptions.APIError):
+                    st.error(f"Erro de API do Google ao atualizar status na planilha '{user_sheet_name}': {e}")
+                else:
+                    st.error(f"Erro inesperado ao atualizar status na planilha '{user_sheet_name}': {e}")
+                    logger.exception(f"Erro inesperado ao atualizar status na planilha '{user_sheet_name}'")
+                # Nothing from this sheet is applied locally
+                local_updates = [u for u in local_updates if u[4] not in user_doc_ids]
+                already_failed = set(failed_ids)
+                failed_ids.extend(d for d in user_doc_ids if d not in already_failed)
+
+        if local_updates:
+            try:
+                with self._local_transaction() as conn:
+                    conn.executemany("""
+                        UPDATE documentos
+                        SET status = ?, data_validacao = ?, validado_por = ?, observacoes_validacao = ?, is_synced = 1
+                        WHERE id = ?
+                    """, local_updates)
+                updated_ids.extend(u[4] for u in local_updates)
+                logger.info(f"{len(local_updates)} local document(s) updated successfully.")
+            except sqlite3.Error as e:
+                st.error(f"Falha ao atualizar os registros locais: {e}")
+                failed_ids.extend(u[4] for u in local_updates)
+        return updated_ids, failed_ids
 
     def get_all_users_local_with_sync(self):
         """Gets all users from local cache including sync time."""
@@ -923,70 +1502,41 @@ class HybridDBManager:
          return user_info['last_sync_timestamp'] if user_info else "N/A"
 
 
+    def close(self, wait_for_sheet_writes=True):
+        """
+        Finishes the queued sheet writes and closes the local SQLite connection. Safe to call more than once.
+        With wait_for_sheet_writes=False the queued writes are cancelled instead, but a write already running is
+        still awaited: its rollback needs the connection.
+        No PRAGMA optimize here: the DB is in memory and gone after this, and the session load already runs ANALYZE.
+        """
+        if getattr(self, '_gs_exec', None):
+            self._gs_exec.shutdown(wait=True, cancel_futures=not wait_for_sheet_writes)
+            self._gs_exec = None
+        if getattr(self, 'local_conn', None):
+            with self._lock:
+                self.local_conn.close()
+                self.local_conn = None
+            logger.info("Local SQLite connection closed.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
     def __del__(self):
-        """Close the local SQLite connection when the object is garbage collected."""
-        if hasattr(self, 'local_conn') and self.local_conn:
-            self.local_conn.close()
-            print("Local SQLite connection closed.")
+        """Fallback for managers dropped without close(); queued sheet writes are cancelled rather than run."""
+        self.close(wait_for_sheet_writes=False)
             
     def get_analise_cliente_data_local(self, cliente_id, colaborador_username=None, tipos_cliente_filter=None):
          """ Fetches data needed for the 'Análise por Cliente' donut charts, by cliente_id. """
-         total_documentos_cliente = 0
-         documentos_validados = 0
-         documentos_nao_validados = 0 
-         criterios_counts = {crit: 0 for crit in config.CRITERIA_COLORS.keys()}
-
-         base_query = "SELECT d.status, d.dimensao_criterio FROM documentos d "
-         conditions = ["d.cliente_id = ? COLLATE NOCASE"]
-         params = [cliente_id]
-
-         if colaborador_username:
-             conditions.append("d.colaborador_username = ? COLLATE NOCASE")
-             params.append(colaborador_username)
-        
-         # This filter seems redundant if cliente_id is already specified, but kept for consistency if needed.
-         if tipos_cliente_filter and "Todos" not in tipos_cliente_filter and tipos_cliente_filter:
-             base_query += " JOIN clientes c ON d.cliente_id = c.id " # Join needed if type filter is active
-             if isinstance(tipos_cliente_filter, str):
-                 tipos_cliente_filter = [tipos_cliente_filter]
-             placeholders = ','.join('?'*len(tipos_cliente_filter))
-             conditions.append(f"c.tipo IN ({placeholders})")
-             params.extend(tipos_cliente_filter)
-        
-         if conditions:
-             base_query += " WHERE " + " AND ".join(conditions)
-        
-         all_client_docs_results = self._execute_local_sql(base_query, tuple(params))
-
-         if all_client_docs_results:
-             for row in all_client_docs_results: # Each row is already a dict from sqlite3.Row
-                 status = row['status']
-                 dimensao = row['dimensao_criterio']
-
-                 total_documentos_cliente +=1 # Count every document fetched for this client
-
-                 if status == 'Validado':
-                     documentos_validados += 1
-                     if dimensao in criterios_counts: # Only count if 'Validado'
-                         criterios_counts[dimensao] += 1
-                 # else: # Any other status means it's not validated.
-                     # documentos_nao_validados +=1 # This line is moved outside the loop for correct calculation
-
-         documentos_nao_validados = total_documentos_cliente - documentos_validados
-         
-         # Ensure all criteria keys are present in the output even if count is 0
-         for crit_key in config.CRITERIA_COLORS.keys():
-             if crit_key not in criterios_counts:
-                 criterios_counts[crit_key] = 0
-
-
-         analise = {
-             'total_documentos_cliente': total_documentos_cliente,
-             'docs_validados': documentos_validados,
-             'docs_invalidos': documentos_nao_validados, # Renamed for consistency with UI
-             'criterios_counts': criterios_counts
-         }
-         return analise
+         return self.get_dashboard_snapshot_local(
+             colaborador_username=colaborador_username,
+             cliente_id=cliente_id,
+             tipos_cliente_filter=tipos_cliente_filter,
+             cliente_id_nocase=True # Same matching as the original analysis query
+         )['analise']
     
     def get_assigned_clients_local(self, colaborador_username):
         """
@@ -1019,97 +1569,164 @@ class HybridDBManager:
         return [dict(row) for row in results] if results else []
 
     def assign_clients_to_collab(self, colaborador_username, client_ids_to_assign): # ACEITA IDs
-        """Assigns clients (by ID) to a collaborator, updating local DB and GSheets."""
+        """
+        Assigns clients (by ID) to a collaborator, updating local DB and GSheets.
+        True means committed locally with the sheet append queued, not yet saved to the sheet: the append runs
+        on the background worker, and a failure is rolled back and shown by report_sheet_write_failures.
+        """
         if not colaborador_username or not client_ids_to_assign:
             st.warning("Nome de colaborador ou lista de IDs de clientes está vazia.")
             return False
 
-        print(f"Atribuindo clientes com IDs {client_ids_to_assign} para {colaborador_username}...")
+        logger.info(f"Atribuindo clientes com IDs {client_ids_to_assign} para {colaborador_username}...")
         assignments_to_add_gsheet = [] # Para a planilha, ainda [(username, client_id)]
-        assign_success_count = 0
         assign_fail_count = 0
 
-        with self.local_conn:
-             cursor = self.local_conn.cursor()
-             for cliente_id in client_ids_to_assign:
-                  try:
-                       cursor.execute("""
+        with self._lock:
+             # Uma consulta para as atribuições já existentes; a tabela recarregada via to_sql não tem a PK,
+             # então o INSERT OR IGNORE sozinho não evitaria duplicatas
+             existing_ids = {row['cliente_id'] for row in self.local_conn.execute(
+                 "SELECT cliente_id FROM colaborador_cliente WHERE colaborador_username = ? COLLATE NOCASE",
+                 (colaborador_username,)
+             )}
+             new_ids = [cid for cid in dict.fromkeys(client_ids_to_assign) if cid not in existing_ids]
+             try:
+                  with self._local_transaction() as conn:
+                       conn.executemany("""
                            INSERT OR IGNORE INTO colaborador_cliente (colaborador_username, cliente_id)
                            VALUES (?, ?)
-                       """, (colaborador_username, cliente_id)) # SALVA ID
-                       if cursor.rowcount > 0:
-                            assignments_to_add_gsheet.append([colaborador_username, cliente_id])
-                       assign_success_count += 1
-                  except sqlite3.Error as e:
-                       print(f"Erro ao inserir atribuição local: {colaborador_username} -> ID {cliente_id}. Error: {e}")
-                       assign_fail_count += 1
+                       """, [(colaborador_username, cid) for cid in new_ids]) # SALVA ID
+                  assignments_to_add_gsheet = [[colaborador_username, cid] for cid in new_ids]
+             except sqlite3.Error as e:
+                  logger.error(f"Erro ao inserir atribuições locais: {colaborador_username} -> IDs {new_ids}. Error: {e}")
+                  assign_fail_count = len(new_ids)
         
         if assignments_to_add_gsheet:
              ws = self._get_worksheet(config.SHEET_ASSOC)
              if ws:
-                  try:
-                       # Assume que SHEET_ASSOC agora espera [colaborador_username, cliente_id]
-                       ws.append_rows(assignments_to_add_gsheet, value_input_option='USER_ENTERED')
-                       print(f"{len(assignments_to_add_gsheet)} novas atribuições (ID) adicionadas à planilha '{config.SHEET_ASSOC}'.")
-                  except Exception as e:
-                       st.error(f"Erro ao salvar atribuições (ID) na planilha '{config.SHEET_ASSOC}': {e}")
-                       return False
+                  # Local state is already committed; the sheet append finishes in the background
+                  self._pending_sheet_writes.append(
+                      self._gs_exec.submit(self._flush_assignment_sync, ws, assignments_to_add_gsheet)
+                  )
              else:
                   st.error(f"Planilha de atribuições '{config.SHEET_ASSOC}' não encontrada. Atribuições não salvas na nuvem.")
                   return False
         if assign_fail_count > 0:
             st.error(f"{assign_fail_count} atribuições falharam ao salvar localmente.")
             return False
-        # st.success(f"{assign_success_count} atribuições (ID) salvas/verificadas com sucesso.") # Removido para evitar muitos toasts
         return True
 
+    def _flush_assignment_sync(self, ws, assignments):
+        """
+        Background worker for assign_clients_to_collab: appends the rows to the associations sheet.
+        Runs off the script thread, so it can't call st.*: on failure the local rows are removed again and an
+        _AssignmentSyncError is raised into the future; report_sheet_write_failures shows it on the next rerun.
+        """
+        try:
+            _sheets_call(ws.append_rows, assignments, value_input_option='USER_ENTERED', retry_server_errors=False)
+            logger.info(f"{len(assignments)} novas atribuições (ID) adicionadas à planilha '{config.SHEET_ASSOC}'.")
+        except Exception as e:
+            logger.error(f"Erro ao salvar atribuições (ID) na planilha '{config.SHEET_ASSOC}': {e}")
+            # _local_transaction commits the rollback and then clears the read memo, all under self._lock,
+            # so a memoized read on the script thread can't store a result that still has these rows
+            with self._local_transaction() as conn:
+                conn.executemany(
+                    "DELETE FROM colaborador_cliente WHERE colaborador_username = ? COLLATE NOCASE AND cliente_id = ?",
+                    assignments
+                )
+            raise _AssignmentSyncError(assignments, e) from e
+
+    def _collect_sheet_write_failures(self, wait=False):
+        """
+        Moves finished background sheet writes out of the pending list, keeping an error message for each one
+        that failed (and was rolled back locally). With wait=True it first blocks until the queued writes are done.
+        """
+        still_pending = []
+        for future in self._pending_sheet_writes:
+            if not wait and not future.done():
+                still_pending.append(future)
+                continue
+            error = future.exception()
+            if isinstance(error, _AssignmentSyncError):
+                pares = ", ".join(f"{username} -> {cliente_id}" for username, cliente_id in error.assignments)
+                self._sheet_write_errors.append(
+                    f"Falha ao salvar atribuições na planilha '{config.SHEET_ASSOC}'; foram desfeitas: {pares}. Erro: {error.cause}")
+            elif error is not None:
+                self._sheet_write_errors.append(f"Falha em uma gravação em segundo plano na planilha: {error}")
+        self._pending_sheet_writes = still_pending
+
+    def report_sheet_write_failures(self):
+        """
+        Shows an st.error for every background sheet write that failed since the last call. Pages call this
+        on each rerun; failures found while a reload waited are kept until then, so a st.rerun() can't hide them.
+        """
+        self._collect_sheet_write_failures()
+        errors, self._sheet_write_errors = self._sheet_write_errors, []
+        for message in errors:
+            st.error(message)
+
+    def _wait_for_sheet_writes(self):
+        """Blocks until the queued background sheet writes are done; failures are shown on the next page rerun."""
+        self._collect_sheet_write_failures(wait=True)
+
     def unassign_clients_from_collab(self, colaborador_username, client_ids_to_unassign): # ACEITA IDs
         """Removes client assignments (by ID) for a collaborator (local and GSheets)."""
         if not colaborador_username or not client_ids_to_unassign:
              st.warning("Nome de colaborador ou lista de IDs de clientes para desatribuir está vazia.")
              return False
 
-        print(f"Removendo atribuições de IDs {client_ids_to_unassign} de {colaborador_username}...")
+        logger.info(f"Removendo atribuições de IDs {client_ids_to_unassign} de {colaborador_username}...")
         local_delete_count = 0
-        with self.local_conn:
-             cursor = self.local_conn.cursor()
-             placeholders = ','.join('?' * len(client_ids_to_unassign))
-             params = [colaborador_username] + client_ids_to_unassign
-             cursor.execute(f"""
-                 DELETE FROM colaborador_cliente
-                 WHERE colaborador_username = ? COLLATE NOCASE
-                 AND cliente_id IN ({placeholders}) -- COMPARA POR ID
-             """, tuple(params))
-             local_delete_count = cursor.rowcount
+        with self._local_transaction() as conn:
+             for chunk in _in_chunks(list(client_ids_to_unassign)):
+                  local_delete_count += conn.execute(f"""
+                      DELETE FROM colaborador_cliente
+                      WHERE colaborador_username = ? COLLATE NOCASE
+                      AND cliente_id IN ({_placeholders(len(chunk))}) -- COMPARA POR ID
+                  """, tuple([colaborador_username] + chunk)).rowcount
 
         if local_delete_count == 0 and client_ids_to_unassign:
              st.warning("Nenhuma atribuição (por ID) encontrada localmente para remover.")
         
+        self._wait_for_sheet_writes() # A queued append of these rows must land before we look for them
         ws = self._get_worksheet(config.SHEET_ASSOC)
         if ws:
             try:
                 # A remoção da GSheet agora precisa encontrar linhas baseadas em (colaborador_username, cliente_id)
                 # Isso requer que a GSheet 'SHEET_ASSOC' tenha 'cliente_id'
-                all_assoc_records_gsheet = ws.get_all_records(head=1) # Assume header na linha 1
-                rows_to_delete_indices_gsheet = []
-
-                # Encontrar as linhas para deletar na GSheet
-                for i, record_gsheet in enumerate(all_assoc_records_gsheet):
-                    record_collab_user = str(record_gsheet.get(config.ASSOC_COLS[0], '')).lower() # colaborador_username
-                    record_client_val = str(record_gsheet.get(config.ASSOC_COLS[1], '')) # cliente_id
-
-                    if record_collab_user == colaborador_username.lower() and record_client_val in client_ids_to_unassign:
-                        rows_to_delete_indices_gsheet.append(i + 2) # +1 header, +1 0-based to 1-based
+                # Só as duas colunas filtradas, sem o cabeçalho; linhas como listas em vez de dicts
+                last_col = _col_letter(len(config.ASSOC_COLS))
+                assoc_rows_gsheet = ws.get_values(f"A2:{last_col}")
+                user_idx = config.ASSOC_COL_IDX['colaborador_username']
+                client_idx = config.ASSOC_COL_IDX['cliente_id']
+                target_user = colaborador_username.lower()
+                target_ids = set(client_ids_to_unassign)
+
+                # Encontrar as linhas para deletar na GSheet (todas as ocorrências, incluindo duplicadas)
+                rows_to_delete_indices_gsheet = [
+                    row_number for row_number, row in enumerate(assoc_rows_gsheet, start=2) # +1 header, +1 0-based to 1-based
+                    if len(row) > client_idx
+                    and row[user_idx].lower() == target_user and row[client_idx] in target_ids
+                ]
 
                 if rows_to_delete_indices_gsheet:
-                    print(f"Deletando {len(rows_to_delete_indices_gsheet)} linhas (por ID) da planilha '{config.SHEET_ASSOC}'...")
-                    rows_to_delete_indices_gsheet.sort(reverse=True)
-                    for row_idx_gsheet in rows_to_delete_indices_gsheet:
-                        try:
-                            ws.delete_rows(row_idx_gsheet)
-                        except Exception as del_err_gsheet:
-                            print(f"Erro ao deletar linha {row_idx_gsheet} (por ID) da planilha: {del_err_gsheet}")
-                    print("Remoção (por ID) da planilha concluída (ou tentativas feitas).")
+                    logger.info(f"Deletando {len(rows_to_delete_indices_gsheet)} linhas (por ID) da planilha '{config.SHEET_ASSOC}'...")
+                    # Consecutive rows collapse into one deleteDimension; all of them go in a single batchUpdate.
+                    # Ranges are sent bottom-up so earlier deletions don't shift the later ones.
+                    delete_runs = [] # [first_row, last_row], 1-based, descending
+                    for row_idx_gsheet in sorted(rows_to_delete_indices_gsheet, reverse=True):
+                        if delete_runs and row_idx_gsheet == delete_runs[-1][0] - 1:
+                            delete_runs[-1][0] = row_idx_gsheet
+                        else:
+                            delete_runs.append([row_idx_gsheet, row_idx_gsheet])
+                    _sheets_call(self.spreadsheet.batch_update, {'requests': [
+                        {'deleteDimension': {'range': {
+                            'sheetId': ws.id, 'dimension': 'ROWS',
+                            'startIndex': first_row - 1, 'endIndex': last_row # 0-based, end exclusive
+                        }}}
+                        for first_row, last_row in delete_runs
+                    ]}, retry_server_errors=False)
+                    logger.info(f"Remoção (por ID) da planilha concluída em {len(delete_runs)} intervalo(s).")
             except Exception as e_gsheet:
                 st.error(f"Erro ao processar remoção (por ID) da planilha '{config.SHEET_ASSOC}': {e_gsheet}")
                 return False
@@ -1121,64 +1738,58 @@ class HybridDBManager:
 
 
     def add_cliente_local_and_gsheet(self, nome, tipo):
-        if self._execute_local_sql("SELECT id FROM clientes WHERE nome = ? COLLATE NOCASE", (nome,), fetch_mode="one"):
-             st.error(f"Cliente '{nome}' já existe localmente.")
-             return False
         ws_clients = self._get_worksheet(config.SHEET_CLIENTS)
-        if ws_clients:
-            try: # Check 'nome' in column 2 (index 1 of CLIENTS_COLS)
-                 if config.CLIENTS_COLS.index('nome') + 1: # ensure 'nome' is in config
-                    nome_col_idx = config.CLIENTS_COLS.index('nome') + 1
-                    cell = ws_clients.find(nome, in_column=nome_col_idx)
-                    if cell:
-                         st.error(f"Cliente '{nome}' já existe na planilha.")
-                         return False
-            except Exception as e:
-                 st.error(f"Erro ao verificar duplicidade de cliente na planilha: {e}")
-                 return False # Or proceed with caution
-        else:
+        if not ws_clients:
              st.error(f"Planilha '{config.SHEET_CLIENTS}' não encontrada.")
              return False
         client_id = str(uuid.uuid4())
-        add_local_success = False
-        try:
-            rowcount = self._execute_local_sql("INSERT INTO clientes (id, nome, tipo) VALUES (?, ?, ?)", (client_id, nome, tipo), fetch_mode=None)
-            if rowcount == 1: add_local_success = True
-        except sqlite3.Error as e: st.error(f"Erro SQLite ao adicionar cliente: {e}")
-        if not add_local_success: return False
+        try: # Dedup via idx_clientes_nome_nocase; sheet-side duplicates are caught on the next full load
+            with self._local_transaction() as conn:
+                # The index can't be built when the sheet already holds a duplicate name, so check explicitly too
+                if conn.execute("SELECT 1 FROM clientes WHERE nome = ? COLLATE NOCASE LIMIT 1", (nome,)).fetchone():
+                    raise sqlite3.IntegrityError("duplicate client name")
+                conn.execute("INSERT OR ABORT INTO clientes (id, nome, tipo) VALUES (?, ?, ?)", (client_id, nome, tipo))
+        except sqlite3.IntegrityError:
+            st.error(f"Cliente '{nome}' já existe.")
+            return False
+        except sqlite3.Error as e:
+            st.error(f"Erro SQLite ao adicionar cliente: {e}")
+            return False
         try:
             client_data_ordered = [None] * len(config.CLIENTS_COLS) # Ensure correct order
-            for i, col_name in enumerate(config.CLIENTS_COLS):
-                if col_name == 'id': client_data_ordered[i] = client_id
-                elif col_name == 'nome': client_data_ordered[i] = nome
-                elif col_name == 'tipo': client_data_ordered[i] = tipo
-            ws_clients.append_row(client_data_ordered, value_input_option='USER_ENTERED')
+            client_data_ordered[config.CLIENTS_COL_IDX['id']] = client_id
+            client_data_ordered[config.CLIENTS_COL_IDX['nome']] = nome
+            client_data_ordered[config.CLIENTS_COL_IDX['tipo']] = tipo
+            _sheets_call(ws_clients.append_row, client_data_ordered, value_input_option='USER_ENTERED', retry_server_errors=False)
             st.success(f"Cliente '{nome}' ({tipo}) adicionado com sucesso.")
             return True
         except Exception as e:
-            st.error(f"Cliente adicionado localmente, mas falha ao adicionar na planilha: {e}")
-            # Consider rollback here
+            st.error(f"Falha ao adicionar o cliente na planilha; cliente não foi salvo: {e}")
+            # Remove the local row so a retry isn't rejected as a duplicate until the next reload
+            self._execute_local_sql("DELETE FROM clientes WHERE id = ?", (client_id,), fetch_mode=None)
             return False
 
     def _hash_password(self, password):
-        return hashlib.sha256(password.encode('utf-8')).hexdigest()
+        """Kept for the admin page (user creation); the hashing itself is the module-level _hash_password."""
+        return _hash_password(password)
 
 class Autenticador:
+    # Per-login session keys; 'db_manager' is deliberately not here so it survives logout
+    _SESSION_KEYS = (
+        'logged_in', 'username', 'role', 'nome_completo',
+        'cliente_nome', 'cliente_id_logado',
+        'data_loaded', 'last_load_time', 'unsaved_changes'
+    )
+
     def __init__(self, db_manager: HybridDBManager):
         self.gerenciador_bd = db_manager
 
-    def _hash_password(self, password):
-        return hashlib.sha256(password.encode('utf-8')).hexdigest()
-
-    def _verificar_senha(self, stored_hashed_password, provided_password):
-        return stored_hashed_password == self._hash_password(provided_password)
-
     def change_password(self, username, old_password, new_password):
         """
         Changes a user's password in the local database and Google Sheets.
         Returns (True, "Success message") or (False, "Error message").
         """
-        print(f"Attempting to change password for user: {username}")
+        logger.info(f"Attempting to change password for user: {username}")
 
         # 1. Validate new password length
         if len(new_password) < config.MIN_PASSWORD_LENGTH:
@@ -1190,37 +1801,37 @@ class Autenticador:
             return False, "Erro: Planilha de usuários não acessível."
 
         try:
-            user_records = users_ws.get_all_records() # List of dicts
-            user_row_index = -1
-            user_data_gsheet = None
+            # One values read gives both the header and the rows (get_all_records + row_values was two)
+            all_values = users_ws.get_values()
+            header = all_values[0] if all_values else []
+            try:
+                username_col = header.index('username')
+                password_col = header.index('hashed_password')
+            except ValueError:
+                return False, "Erro de configuração: Colunas 'username'/'hashed_password' não encontradas na planilha de usuários."
 
             # Find user and their row index
-            for idx, record in enumerate(user_records):
-                if str(record.get('username','')).strip().lower() == str(username).strip().lower():
-                    user_row_index = idx + 2 # +1 for header, +1 for 0-based to 1-based
-                    user_data_gsheet = record
-                    break
-            
-            if not user_data_gsheet:
+            username_lower = str(username).strip().lower()
+            user_row_index, user_row = next(
+                ((idx + 2, row) for idx, row in enumerate(all_values[1:]) # +1 for header, +1 for 0-based to 1-based
+                 if str(row[username_col]).strip().lower() == username_lower),
+                (-1, None)
+            )
+            if user_row is None:
                 return False, "Usuário não encontrado na planilha."
 
-            stored_hash = user_data_gsheet.get('hashed_password')
-            if not stored_hash or not self._verificar_senha(stored_hash, old_password):
+            stored_hash = user_row[password_col]
+            if not stored_hash or not _verificar_senha(stored_hash, old_password):
                 return False, "Senha antiga incorreta."
 
             # 3. Hash the new password
-            new_hashed_password = self._hash_password(new_password)
+            new_hashed_password = _hash_password(new_password)
 
             # 4. Update GSheet
-            # Find the column index for 'hashed_password'
-            header = users_ws.row_values(1)
-            try:
-                password_col_index_gsheet = header.index('hashed_password') + 1
-            except ValueError:
-                return False, "Erro de configuração: Coluna 'hashed_password' não encontrada na planilha de usuários."
+            password_col_index_gsheet = password_col + 1
 
-            users_ws.update_cell(user_row_index, password_col_index_gsheet, new_hashed_password)
-            print(f"Password updated in GSheet for user {username}.")
+            _sheets_call(users_ws.update_cell, user_row_index, password_col_index_gsheet, new_hashed_password)
+            logger.info(f"Password updated in GSheet for user {username}.")
 
             # 5. Update local SQLite database
             update_local_sql = "UPDATE usuarios SET hashed_password = ? WHERE username = ? COLLATE NOCASE"
@@ -1232,7 +1843,7 @@ class Autenticador:
 
             if rows_updated == 1:
                 self.gerenciador_bd.local_conn.commit() # Ensure commit for local DB
-                print(f"Password updated in local DB for user {username}.")
+                logger.info(f"Password updated in local DB for user {username}.")
                 # It's good practice to also update the last_sync_timestamp if you have one for users
                 # self.gerenciador_bd._update_last_sync_time_gsheet(username) # Optional: if you want to mark this as a sync-worthy event
                 return True, "Senha alterada com sucesso!"
@@ -1240,33 +1851,33 @@ class Autenticador:
                 # This case (GSheet updated, local failed) is problematic.
                 # Should ideally have a rollback for GSheet or a retry mechanism for local.
                 # For now, log and report error.
-                print(f"CRITICAL: Password updated in GSheet but FAILED to update in local DB for user {username}.")
+                logger.critical(f"Password updated in GSheet but FAILED to update in local DB for user {username}.")
                 return False, "Senha atualizada na nuvem, mas falha ao atualizar localmente. Contate o suporte."
 
         except gspread.exceptions.APIError as api_err:
-            print(f"API Error during password change for {username}: {api_err}")
+            logger.error(f"API Error during password change for {username}: {api_err}")
             return False, f"Erro de API do Google ao alterar senha: {api_err}"
         except Exception as e:
-            print(f"Unexpected error during password change for {username}: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"Unexpected error during password change for {username}: {e}")
             return False, f"Erro inesperado ao alterar senha: {e}"
 
     def login(self, username, password):
-        print(f"Attempting login for {username}.")
+        logger.info(f"Attempting login for {username}.")
         # Prioritize local cache for login check for speed after initial load from sheets.
         # However, the very first login must hit GSheets if local cache is empty.
         # The current _check_login_on_sheets always hits GSheets.
         
-        success, user_info_or_error = self._check_login_on_sheets(username, password)
+        success, user_info_or_error, users_values = self._check_login_on_sheets(username, password)
 
         if success:
              user_info = user_info_or_error 
-             st.session_state['logged_in'] = True
-             st.session_state['username'] = user_info['username']
-             st.session_state['role'] = user_info['role']
-             st.session_state['nome_completo'] = user_info['nome_completo']
-             st.session_state['cliente_nome'] = None 
+             st.session_state.update({
+                 'logged_in': True,
+                 'username': user_info['username'],
+                 'role': user_info['role'],
+                 'nome_completo': user_info['nome_completo'],
+                 'cliente_nome': None
+             })
 
              if user_info['role'] == 'Cliente':
                   # For 'Cliente' role, their username IS the client's name.
@@ -1278,7 +1889,7 @@ class Autenticador:
                   if cliente_obj:
                       st.session_state['cliente_nome'] = cliente_obj['nome'] # Storing name
                       st.session_state['cliente_id_logado'] = cliente_obj['id'] # Storing ID
-                      print(f"Client login: {cliente_obj['nome']}, ID: {cliente_obj['id']}")
+                      logger.info(f"Client login: {cliente_obj['nome']}, ID: {cliente_obj['id']}")
                   else: # Should not happen if client user exists and clients table is synced
                       st.error(f"Informação do cliente '{user_info['username']}' não encontrada.")
                       self._clear_session()
@@ -1289,7 +1900,7 @@ class Autenticador:
                        st.error("Critical Error: DB Manager not found in session state during login.")
                        self._clear_session()
                        return False, "Internal server error during login."
-                  manager_instance.load_data_for_session(user_info['username'], user_info['role'])
+                  manager_instance.load_data_for_session(user_info['username'], user_info['role'], users_values=users_values)
              except Exception as load_e:
                   st.error(f"Failed to load data after login: {load_e}")
                   self._clear_session() 
@@ -1299,60 +1910,78 @@ class Autenticador:
             return False, user_info_or_error
 
     def _clear_session(self):
-        keys_to_clear = [
-            'logged_in', 'username', 'role', 'nome_completo', 
-            'cliente_nome', 'cliente_id_logado', # Added cliente_id_logado
-            'data_loaded', 'last_load_time', 'unsaved_changes'
-            # 'db_manager' is typically kept
-        ]
-        for key in keys_to_clear:
-            if key in st.session_state:
-                del st.session_state[key]
-        print(f"Cleared session keys for logout/error.")
+        for key in self._SESSION_KEYS:
+            st.session_state.pop(key, None)
+        logger.info(f"Cleared session keys for logout/error.")
 
     def logout(self):
         self._clear_session()
-        print("User logged out.")
-        st.cache_resource.clear() 
-        st.cache_data.clear()    
-        st.rerun() 
+        logger.info("User logged out.")
+        # Only cached data is dropped: st.cache_resource holds the gspread client shared by every
+        # session in the process, and clearing it would force all users to re-authorize.
+        st.cache_data.clear()
+        st.rerun()
 
     def _check_login_on_sheets(self, username, password):
+        """
+        Checks the credentials against the users sheet.
+        Returns (success, user_info or error message, users_values); users_values is the raw sheet read
+        (header + rows), handed on to load_data_for_session so the sheet is not downloaded twice.
+        """
         users_ws = self.gerenciador_bd._get_worksheet(config.SHEET_USERS)
-        if not users_ws: return False, "Error: User worksheet not accessible."
+        if not users_ws: return False, "Error: User worksheet not accessible.", None
         try:
-              user_data_list = users_ws.get_all_records()
-              user_data = next((record for record in user_data_list
-                                if str(record.get('username','')).strip().lower() == str(username).strip().lower()), None)
-              if user_data and isinstance(user_data, dict):
+              users_values = users_ws.get_values()
+              header = users_values[0] if users_values else []
+              if 'username' not in header: return False, "Usuário não encontrado.", users_values
+              username_pos = header.index('username')
+              target = str(username).strip().lower()
+              user_idx, user_row = next(((idx, row) for idx, row in enumerate(users_values[1:])
+                                if str(row[username_pos]).strip().lower() == target), (None, None))
+              if user_row is not None:
+                   user_data = dict(zip(header, user_row))
                    stored_hash = user_data.get('hashed_password')
-                   if stored_hash and self._verificar_senha(stored_hash, password):
-                        return True, dict(user_data)
-                   else: return False, "Senha incorreta."
-              else: return False, "Usuário não encontrado."
+                   if stored_hash and _verificar_senha(stored_hash, password):
+                        if _password_needs_rehash(stored_hash):
+                             # Upgrade legacy/outdated hash in the sheet and in the values the session load reuses
+                             try:
+                                  hash_pos = header.index('hashed_password')
+                                  new_hash = _hash_password(password)
+                                  _sheets_call(users_ws.update_cell, user_idx + 2, hash_pos + 1, new_hash)
+                                  user_row[hash_pos] = user_data['hashed_password'] = new_hash
+                                  logger.info(f"Upgraded password hash for user {username}.")
+                             except Exception as e_rehash:
+                                  logger.warning(f"could not upgrade password hash for {username}: {e_rehash}")
+                        return True, user_data, users_values
+                   else: return False, "Senha incorreta.", users_values
+              else: return False, "Usuário não encontrado.", users_values
         except Exception as e:
               st.error(f"Error verifying user in the sheet: {e}")
-              return False, "Error during login attempt."
+              return False, "Error during login attempt.", None
 
     def add_default_admin_if_needed(self):
+        global _default_admin_confirmed
+        if _default_admin_confirmed: # Already checked/created by an earlier session in this process
+            return
         users_ws = self.gerenciador_bd._get_worksheet(config.SHEET_USERS)
         if not users_ws:
-            print("Warning: Cannot check/add default admin, user sheet not found.")
+            logger.warning("Cannot check/add default admin, user sheet not found.")
             return
         try:
-            data = users_ws.get_all_records() 
-            admin_exists = any(str(record.get('username','')).strip() == config.DEFAULT_ADMIN_USER for record in data)
+            # Existence check only needs the username column, not every user record
+            usernames = users_ws.col_values(config.USERS_COL_IDX['username'] + 1)
+            admin_exists = any(str(u).strip() == config.DEFAULT_ADMIN_USER for u in usernames[1:]) # Skip header
             if not admin_exists:
-                print(f"Admin '{config.DEFAULT_ADMIN_USER}' not found. Adding to GSheet...")
-                hashed_pw = self._hash_password(config.DEFAULT_ADMIN_PASS)
+                logger.info(f"Admin '{config.DEFAULT_ADMIN_USER}' not found. Adding to GSheet...")
+                hashed_pw = _hash_password(config.DEFAULT_ADMIN_PASS)
                 admin_data_row = [None] * len(config.USERS_COLS)
-                for i, col_name in enumerate(config.USERS_COLS):
-                    if col_name == 'username': admin_data_row[i] = config.DEFAULT_ADMIN_USER
-                    elif col_name == 'hashed_password': admin_data_row[i] = hashed_pw
-                    elif col_name == 'nome_completo': admin_data_row[i] = "Administrador Padrão"
-                    elif col_name == 'role': admin_data_row[i] = "Admin"
-                    # last_sync_timestamp can be None or empty string initially
-                users_ws.append_row(admin_data_row, value_input_option='USER_ENTERED')
-                print("Default admin added to the sheet.")
+                admin_data_row[config.USERS_COL_IDX['username']] = config.DEFAULT_ADMIN_USER
+                admin_data_row[config.USERS_COL_IDX['hashed_password']] = hashed_pw
+                admin_data_row[config.USERS_COL_IDX['nome_completo']] = "Administrador Padrão"
+                admin_data_row[config.USERS_COL_IDX['role']] = "Admin"
+                # last_sync_timestamp can be None or empty string initially
+                _sheets_call(users_ws.append_row, admin_data_row, value_input_option='USER_ENTERED', retry_server_errors=False)
+                logger.info("Default admin added to the sheet.")
+            _default_admin_confirmed = True
         except Exception as e:
-             print(f"Error checking/adding default admin: {e}")
\ No newline at end of file
+             logger.error(f"Error checking/adding default admin: {e}")
\ No newline at end of file
@@ -16,6 +16,7 @@ if not st.session_state.get('data_loaded') or not st.session_state.get('db_manag
     st.stop()
 
 manager = st.session_state.db_manager
+manager.report_sheet_write_failures() # Background sheet writes that failed since the last rerun
 role = st.session_state.get('role')
 username = st.session_state.get('username')
 nome_completo = st.session_state.get('nome_completo')
@@ -43,10 +44,15 @@ if role == 'Cliente':
     periodo_dias_map = {"Últimos 7 dias": 7, "Últimos 30 dias": 30, "Últimos 90 dias": 90}
     periodo_dias_filter = periodo_dias_map.get(selected_period_label) 
 
-    kpi_cliente = manager.get_kpi_data_local(
-        cliente_id=cliente_id_logado, # Use cliente_id
-        periodo_dias=periodo_dias_filter
-    )
+    # One scan feeds both the KPI cards and the 'Status Geral' charts below
+    snapshot_cliente = manager.get_dashboard_snapshot_local(cliente_id=cliente_id_logado)
+    if periodo_dias_filter:
+        kpi_cliente = manager.get_kpi_data_local(
+            cliente_id=cliente_id_logado, # Use cliente_id
+            periodo_dias=periodo_dias_filter
+        )
+    else:
+        kpi_cliente = snapshot_cliente['kpi']
     kp1, kp2, kp3 = st.columns(3)
     kp1.metric("Docs Pendentes", f"{kpi_cliente.get('docs_enviados', 0):02d}")
     kp2.metric("Docs Inválidos", f"{kpi_cliente.get('docs_invalidos', 0):02d}") # Assuming 'Pendentes' maps to 'invalidos' KPI key for now
@@ -73,8 +79,7 @@ if role == 'Cliente':
     st.markdown("---")
 
     st.subheader("📊 Status Geral")
-    # Use cliente_id_logado for analysis
-    analysis_data = manager.get_analise_cliente_data_local(cliente_id=cliente_id_logado)
+    analysis_data = snapshot_cliente['analise']
 
 
     col_an1, col_an2 = st.columns(2)
@@ -181,11 +186,13 @@ elif role in ['Admin', 'Usuario']:
 
     # --- KPIs Admin/Usuario ---
     # KPI data needs to be aware of the client_id_filter and tipos_cliente_filter
-    kpi_geral = manager.get_kpi_data_local(
+    # The same snapshot also serves the 'Análise por Cliente' section when a client is selected
+    snapshot_geral = manager.get_dashboard_snapshot_local(
         colaborador_username=selected_colab_filter_user,
         cliente_id=selected_client_id_filter, # Pass ID
         tipos_cliente_filter=selected_tipos_clientes_filter if "Todos" not in selected_tipos_clientes_filter else None
     )
+    kpi_geral = snapshot_geral['kpi']
     kp1, kp2, kp3 = st.columns(3) # Removed one KPI to match client view for now
     kp1.metric("Links Pendentes", f"{kpi_geral.get('docs_enviados', 0):02d}") 
     kp2.metric("Links Validados", f"{kpi_geral.get('docs_validados', 0):02d}") 
@@ -196,7 +203,7 @@ elif role in ['Admin', 'Usuario']:
 
     if not df_pontuacao.empty:
         df_display = df_pontuacao.head(15).sort_values(by='Pontuação', ascending=True) # Ascending for horizontal bar
-        labels = [f"{row['Links Validados']} ({row['Percentual']:.1f}%)" for idx, row in df_display.iterrows()]
+        labels = [f"{validados} ({percentual:.1f}%)" for validados, percentual in zip(df_display['Links Validados'], df_display['Percentual'])]
         colors = [config.DEFAULT_BAR_COLOR] * len(df_display)
         if selected_colab_filter_user:
              selected_user_details = manager.buscar_usuario_local(selected_colab_filter_user)
@@ -223,13 +230,9 @@ elif role in ['Admin', 'Usuario']:
     if client_id_for_analysis: # Check if a specific client ID is selected
         st.info(f"**Cliente Selecionado:** {selected_client_name_filter}") # Display name
 
-        collab_filter_for_analysis = username if role == 'Usuario' else selected_colab_filter_user # Admin can see specific collab's view of client
-        
-        # Pass client_id_for_analysis
-        analysis_data = manager.get_analise_cliente_data_local(
-            cliente_id=client_id_for_analysis,
-            colaborador_username=collab_filter_for_analysis
-        )
+        # Same client/collaborator filters as the KPIs (Usuario is always filtered to itself);
+        # the type filter is implied by the selected client.
+        analysis_data = snapshot_geral['analise']
 
         col_an1, col_an2 = st.columns(2)
         with col_an1: 
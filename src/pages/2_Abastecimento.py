@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime
 import config # Import config
+from hybrid_db import format_display_date, format_display_datetime
 
 st.set_page_config(layout="wide")
 
@@ -18,6 +19,7 @@ if not st.session_state.get('data_loaded') or not st.session_state.get('db_manag
 
 
 manager = st.session_state.db_manager
+manager.report_sheet_write_failures() # Background sheet writes that failed since the last rerun
 username = st.session_state.get('username')
 nome_completo = st.session_state.get('nome_completo')
 
@@ -92,7 +94,7 @@ with tab1:
             )
         with col2:
             links_docs_input_for_count = st.session_state.get("form_links", "") # Get current value if available
-            num_lines = len([line for line in links_docs_input_for_count.strip().split('\n') if line.strip()]) if links_docs_input_for_count else 0
+            num_lines = sum(1 for line in links_docs_input_for_count.splitlines() if line and not line.isspace()) if links_docs_input_for_count else 0
             quantidade_display = st.number_input("Quantidade (Linhas Inseridas Abaixo)", min_value=0, value=num_lines, step=1, key="form_qtd_display", disabled=True)
             
             status_inicial = st.selectbox(
@@ -122,16 +124,15 @@ with tab1:
                  errors.append("Selecione um cliente.")
             if dimensao == "Selecione...": errors.append("Selecione a dimensão/critério.")
 
-            items = [item.strip() for item in links_docs.strip().split('\n') if item.strip()]
+            items = [item for item in map(str.strip, links_docs.splitlines()) if item] # Um strip por linha; aceita \r\n
             if not items: errors.append("Insira pelo menos um link ou nome de documento.")
 
             if errors:
                 for error in errors: st.error(error)
             else:
                 num_added = 0
-                num_failed = 0
-                num_duplicates = 0 # Contador para duplicatas
-                duplicate_messages = [] # Lista para armazenar mensagens de duplicatas
+                duplicate_items = [] # Itens duplicados; as mensagens são montadas só depois do loop
+                failed_items = [] # (item, mensagem de erro)
                 
                 # Obter cliente_id e cliente_tipo com base no cliente_nome_selecionado e no filtro de tipo
                 # Esta lógica assume que client_name_to_id_map e filtered_clients_for_dropdown estão corretos
@@ -144,40 +145,48 @@ with tab1:
                     cliente_id_selecionado = selected_client_data['id']
                     cliente_tipo_selecionado = selected_client_data['tipo'] # Necessário para a mensagem de erro
 
+                    # Datas calculadas uma vez para todo o lote
+                    hoje_iso = datetime.now().date().isoformat()
+                    data_registro_iso = data_reg.isoformat() if data_reg else hoje_iso
+
+                    docs_to_add = []
                     for item_desc in items:
-                        doc_data = {
-                            "id": None, # Será gerado em add_documento_local
+                        docs_to_add.append({
+                            "id": None, # Será gerado em add_documentos_local_bulk
                             "colaborador_username": username,
                             "cliente_nome": cliente_selecionado_nome, # Mantido para referência, mas cliente_id é a chave
                             "cliente_id": cliente_id_selecionado,
-                            "data_registro": data_reg.isoformat() if data_reg else datetime.now().date().isoformat(),
+                            "data_registro": data_registro_iso,
                             "dimensao_criterio": dimensao,
                             "link_ou_documento": item_desc,
                             "quantidade": 1,
                             "status": status_inicial,
-                            "data_envio_original": datetime.now().date().isoformat(), # Data de quando foi adicionado localmente
+                            "data_envio_original": hoje_iso, # Data de quando foi adicionado localmente
                             "data_validacao": None,
                             "validado_por": None,
                             "observacoes_validacao": None,
                             "is_synced": 0
-                        }
-                        add_success, message = manager.add_documento_local(doc_data)
+                        })
+
+                    # Um único INSERT em lote (executemany) para todas as linhas
+                    add_results = manager.add_documentos_local_bulk(docs_to_add)
+                    for item_desc, (add_success, message) in zip(items, add_results):
                         if add_success:
                             num_added += 1
                         elif message == "DUPLICATE":
-                            num_duplicates += 1
-                            duplicate_messages.append(
-                                f"⚠️ **Duplicado:** O item '{item_desc}' já foi registrado para o cliente '{cliente_selecionado_nome} ({cliente_tipo_selecionado})' na dimensão '{dimensao}'."
-                            )
+                            duplicate_items.append(item_desc)
                         else:
-                            num_failed += 1
-                            st.error(f"Falha ao adicionar '{item_desc}': {message}") # Exibe outras mensagens de erro
+                            failed_items.append((item_desc, message))
 
+                    for item_desc, message in failed_items:
+                        st.error(f"Falha ao adicionar '{item_desc}': {message}") # Exibe outras mensagens de erro
                     if num_added > 0: st.success(f"{num_added} registro(s) novo(s) adicionado(s) com sucesso à sua sessão local.")
-                    if duplicate_messages:
-                        for msg in duplicate_messages:
-                            st.warning(msg)
-                    if num_failed > 0: st.warning(f"{num_failed} registro(s) falharam ao ser adicionados por outros motivos.")
+                    if duplicate_items:
+                        # Sufixo comum a todas as mensagens, formatado uma única vez
+                        dup_suffix = f"' já foi registrado para o cliente '{cliente_selecionado_nome} ({cliente_tipo_selecionado})' na dimensão '{dimensao}'."
+                        for item_desc in duplicate_items:
+                            st.warning("⚠️ **Duplicado:** O item '" + item_desc + dup_suffix)
+                    if failed_items: st.warning(f"{len(failed_items)} registro(s) falharam ao ser adicionados por outros motivos.")
                     
                     # Limpar o campo de texto após o processamento bem-sucedido ou parcial
                     # if num_added > 0 or num_duplicates > 0 or num_failed > 0: # Rerun se algo aconteceu
@@ -189,7 +198,7 @@ with tab1:
     editor_key = f"data_editor_{st.session_state.editor_key_counter}"
 
     if unsynced_docs:
-        df_unsynced = pd.DataFrame([dict(row) for row in unsynced_docs])
+        df_unsynced = pd.DataFrame.from_records(unsynced_docs, columns=unsynced_docs[0].keys()) # sqlite3.Row são tuplas; sem dict por linha
         # Ensure 'cliente_nome' is present for display if 'cliente_id' is the primary key
         if 'cliente_id' in df_unsynced.columns and 'cliente_nome' not in df_unsynced.columns:
              # Fetch client names if only IDs are present (shouldn't be the case with current add_documento_local)
@@ -283,7 +292,7 @@ with tab2:
     selected_client_id_my_records = clients_for_user_map.get(selected_client_name_my_records)
 
 
-    status_options = ["Todos"] + config.VALID_STATUSES
+    status_options = ["Todos"] + list(config.VALID_STATUSES)
     with col3:
         selected_status_filter = st.selectbox(
             "Filtrar por Status:",
@@ -304,7 +313,7 @@ with tab2:
         st.info("Você ainda não possui nenhum registro ou nenhum registro corresponde aos filtros.")
         st.stop()
 
-    df_user_docs = pd.DataFrame([dict(row) for row in user_documents_raw])
+    df_user_docs = pd.DataFrame.from_records(user_documents_raw, columns=user_documents_raw[0].keys())
 
     df_filtered = df_user_docs.copy()
     if selected_client_id_my_records: # Filter by specific client ID if selected
@@ -320,48 +329,39 @@ with tab2:
 
     st.divider()
     st.subheader("Resumo dos Seus Registros (com filtros aplicados):")
-    status_counts = df_filtered['status'].value_counts().reindex(config.VALID_STATUSES, fill_value=0)
+    status_counts = df_filtered['status'].value_counts().reindex(list(config.VALID_STATUSES), fill_value=0)
     cols_stats = st.columns(len(config.VALID_STATUSES))
     
     for i, status_name in enumerate(config.VALID_STATUSES):
         count = status_counts.get(status_name, 0)
         cols_stats[i].metric(label=status_name, value=count)
     
-        def format_display_date(date_str, fmt="%d/%m/%Y"):
-            if not date_str or pd.isna(date_str) or str(date_str).lower() == 'none': return "N/A"
-            try: return pd.to_datetime(date_str).strftime(fmt)
-            except: return str(date_str)
-        def format_display_datetime(dt_str, fmt="%d/%m/%Y %H:%M"):
-            if not dt_str or pd.isna(dt_str) or str(dt_str).lower() == 'none': return "N/A"
-            try: return pd.to_datetime(dt_str).strftime(fmt)
-            except: return str(dt_str)
-
-        df_display = df_filtered.copy()
-        if 'data_registro' in df_display.columns: df_display['Data Registro'] = df_display['data_registro'].apply(format_display_date)
-        if 'data_validacao' in df_display.columns: df_display['Data Validação'] = df_display['data_validacao'].apply(format_display_datetime)
-        
-        column_rename_map = {
-            'cliente_nome': 'Cliente', 'dimensao_criterio': 'Critério', 'link_ou_documento': 'Link/Documento',
-            'quantidade': 'Qtd.', 'status': 'Status', 'validado_por': 'Validado Por',
-            'observacoes_validacao': 'Observações', 'is_synced': 'Sincronizado'
-        }
-        df_display.rename(columns={k: v for k, v in column_rename_map.items() if k in df_display.columns}, inplace=True)
-        
-        # Ensure 'Sincronizado' column indicates pending if is_synced is 0
-        if 'Sincronizado' in df_display.columns:
-             df_display['Sincronizado'] = df_display['Sincronizado'].apply(lambda x: 'Pendente' if str(x) == '0' else ('Sim' if str(x) == '1' else 'N/A'))
+    df_display = df_filtered.copy()
+    if 'data_registro' in df_display.columns: df_display['Data Registro'] = df_display['data_registro'].apply(format_display_date)
+    if 'data_validacao' in df_display.columns: df_display['Data Validação'] = df_display['data_validacao'].apply(format_display_datetime)
+    
+    column_rename_map = {
+        'cliente_nome': 'Cliente', 'dimensao_criterio': 'Critério', 'link_ou_documento': 'Link/Documento',
+        'quantidade': 'Qtd.', 'status': 'Status', 'validado_por': 'Validado Por',
+        'observacoes_validacao': 'Observações', 'is_synced': 'Sincronizado'
+    }
+    df_display.rename(columns={k: v for k, v in column_rename_map.items() if k in df_display.columns}, inplace=True)
+    
+    # Ensure 'Sincronizado' column indicates pending if is_synced is 0
+    if 'Sincronizado' in df_display.columns:
+         df_display['Sincronizado'] = df_display['Sincronizado'].astype(str).map({'0': 'Pendente', '1': 'Sim'}).fillna('N/A')
 
 
-        display_columns_ordered = ['Data Registro', 'Cliente', 'Critério', 'Link/Documento', 'Qtd.', 
-                                   'Status', 'Data Validação', 'Validado Por', 'Observações', 'Sincronizado', 'id']
-        final_display_cols = [col for col in display_columns_ordered if col in df_display.columns]
-        
-        column_config_display = {"Link/Documento": st.column_config.LinkColumn("Link/Documento", display_text="Abrir/Ver"), 
-                                 "id": st.column_config.TextColumn("ID (Ref.)", width="small")}
-        for col_name in final_display_cols:
-            if col_name not in column_config_display: 
-                column_config_display[col_name] = st.column_config.TextColumn(col_name, disabled=True)
-        
+    display_columns_ordered = ['Data Registro', 'Cliente', 'Critério', 'Link/Documento', 'Qtd.', 
+                               'Status', 'Data Validação', 'Validado Por', 'Observações', 'Sincronizado', 'id']
+    final_display_cols = [col for col in display_columns_ordered if col in df_display.columns]
+    
+    column_config_display = {"Link/Documento": st.column_config.LinkColumn("Link/Documento", display_text="Abrir/Ver"), 
+                             "id": st.column_config.TextColumn("ID (Ref.)", width="small")}
+    for col_name in final_display_cols:
+        if col_name not in column_config_display: 
+            column_config_display[col_name] = st.column_config.TextColumn(col_name, disabled=True)
+    
     st.dataframe(df_display[final_display_cols], column_config=column_config_display, hide_index=True, use_container_width=True)
 
 
@@ -464,7 +464,7 @@ with tab3:
                     with st.spinner("Atribuindo clientes..."):
                         assign_success = manager.assign_clients_to_collab(username, selected_ids_to_self_assign)
                         if assign_success:
-                            st.success("Clientes atribuídos com sucesso! A lista será atualizada.")
+                            st.success("Clientes atribuídos! A gravação na planilha continua em segundo plano; a lista será atualizada.")
                             st.rerun()
                         else:
                             st.error("Falha ao atribuir os clientes selecionados.")
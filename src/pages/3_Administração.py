@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime
 import config
+from hybrid_db import format_display_date, format_display_datetime
 import gspread 
 
 st.set_page_config(layout="wide")
@@ -17,9 +18,16 @@ if not st.session_state.get('data_loaded') or not st.session_state.get('db_manag
     st.stop()
 
 manager = st.session_state.db_manager
+manager.report_sheet_write_failures() # Background sheet writes that failed since the last rerun
 admin_username = st.session_state.get('username')
 admin_role = st.session_state.get('role')
 
+# Listas base lidas uma vez por execução e compartilhadas por todas as abas
+# (todas as abas rodam a cada rerun; antes cada uma repetia estas consultas)
+colaboradores_all = manager.listar_colaboradores_local() or []
+clientes_all = manager.listar_clientes_local() or []
+tipos_cliente_all = sorted({c['tipo'] for c in clientes_all if c['tipo']})
+
 st.markdown("#### 👑 Painel de Administração")
 st.divider()
 
@@ -36,15 +44,14 @@ with tab1: # Visão Documentos
     col_f1, col_f2, col_f3, col_f4 = st.columns(4) # Added column for Tipo Cliente
     
     with col_f1:
-        colaboradores = manager.listar_colaboradores_local()
+        colaboradores = colaboradores_all
         colab_options_map = {"Todos": None}
         colab_options_map.update({c['nome_completo']: c['username'] for c in colaboradores})
         selected_colab_name_ov = st.selectbox("Filtrar por Colaborador:", list(colab_options_map.keys()), key="ov_colab_filter")
         user_filter_ov = colab_options_map[selected_colab_name_ov]
 
     # Get all client types for the filter
-    all_clients_for_types = manager.listar_clientes_local() # Get all clients for types
-    available_client_types_ov = sorted(list(set(c['tipo'] for c in all_clients_for_types if c['tipo'])))
+    available_client_types_ov = tipos_cliente_all
 
     with col_f2: # Tipo Cliente Filter
         selected_tipos_ov = ["Todos"]
@@ -74,7 +81,7 @@ with tab1: # Visão Documentos
         client_id_filter_ov = client_options_ov_map.get(selected_client_name_ov) # Get ID
 
     with col_f4: # Filter by Status
-        status_options_ov = ["Todos"] + config.VALID_STATUSES
+        status_options_ov = ["Todos"] + list(config.VALID_STATUSES)
         selected_status_ov = st.selectbox("Filtrar por Status:", status_options_ov, key="ov_status_filter")
         status_filter_ov = selected_status_ov if selected_status_ov != "Todos" else None
 
@@ -87,17 +94,9 @@ with tab1: # Visão Documentos
 
     if all_docs:
         df_all_docs = pd.DataFrame(all_docs)
-        def format_display_date(date_str, fmt="%d/%m/%Y"):
-             if not date_str or pd.isna(date_str): return ""
-             try: return pd.to_datetime(date_str).strftime(fmt)
-             except: return str(date_str)
-        def format_display_datetime(dt_str, fmt="%d/%m/%Y %H:%M"):
-             if not dt_str or pd.isna(dt_str): return ""
-             try: return pd.to_datetime(dt_str).strftime(fmt)
-             except: return str(dt_str) 
         df_display_ov = df_all_docs.copy()
-        if 'data_registro' in df_display_ov.columns: df_display_ov['data_registro'] = df_display_ov['data_registro'].apply(format_display_date)
-        if 'data_validacao' in df_display_ov.columns: df_display_ov['data_validacao'] = df_display_ov['data_validacao'].apply(format_display_datetime)
+        if 'data_registro' in df_display_ov.columns: df_display_ov['data_registro'] = df_display_ov['data_registro'].apply(format_display_date, missing="")
+        if 'data_validacao' in df_display_ov.columns: df_display_ov['data_validacao'] = df_display_ov['data_validacao'].apply(format_display_datetime, missing="")
         # print(df_display_ov.columns,'##################################################################################################')
         # Use 'nome_cliente_join' and 'tipo_cliente' from get_all_documents_local if needed for display
         # However, DOCS_COLS still has 'cliente_nome' which should be populated
@@ -152,6 +151,8 @@ with tab2:
         if submitted:
             if not all([new_username, new_fullname, new_password, new_role]):
                 st.error("❌ Por favor, preencha todos os campos.")
+            elif new_role not in config.VALID_UPLOAD_ROLE_SET:
+                st.error(f"❌ Perfil inválido: {new_role}")
             else:
                 # Additional check if role is 'Cliente'
                 if new_role == 'Cliente':
@@ -168,8 +169,10 @@ with tab2:
                     try:
                          users_ws_check = manager._get_worksheet(config.SHEET_USERS)
                          if users_ws_check:
-                              all_users_records = users_ws_check.get_all_records() # More reliable than find() for partial matches
-                              if any(str(r.get('username','')).lower() == new_username.lower() for r in all_users_records):
+                              # Only the username column (one range read instead of the whole sheet as dicts)
+                              existing_usernames = users_ws_check.col_values(config.USERS_COL_IDX['username'] + 1)[1:]
+                              new_username_lower = new_username.lower()
+                              if any(str(u).strip().lower() == new_username_lower for u in existing_usernames):
                                   is_duplicate = True
                          else: raise Exception("Planilha de usuários não encontrada.")
                     except Exception as find_err:
@@ -197,7 +200,7 @@ with tab2:
                                    st.warning(f"⚠️ Planilha '{docs_sheet_name}' já existe. Não será recriada.")
                               except gspread.exceptions.WorksheetNotFound:
                                    new_ws = manager.spreadsheet.add_worksheet(title=docs_sheet_name, rows=20, cols=len(config.DOCS_COLS))
-                                   new_ws.update([config.DOCS_COLS], value_input_option='USER_ENTERED') 
+                                   new_ws.update([list(config.DOCS_COLS)], value_input_option='USER_ENTERED') 
                                    st.success(f"✅ Planilha '{docs_sheet_name}' criada com cabeçalho completo.")
                          if user_added_success:
                               st.info("Atualizando cache de dados local...")
@@ -212,8 +215,7 @@ with tab3:
     with st.form("new_client_form", clear_on_submit=True):
         new_client_name = st.text_input("Nome do Cliente", key="nc_name").strip()
         # Get existing types for better suggestions
-        current_clients_tab3 = manager.listar_clientes_local()
-        tipos_existentes = sorted(list(set([c['tipo'] for c in current_clients_tab3 if c['tipo']])))
+        tipos_existentes = tipos_cliente_all
         tipos_opcao = sorted(list(set(["Prefeitura", "Câmara", "Autarquia", "Outro"] + tipos_existentes)))
         
         new_client_type = st.selectbox("Tipo de Cliente", tipos_opcao, key="nc_type", index=0 if "Prefeitura" in tipos_opcao else 0)
@@ -238,7 +240,7 @@ with tab3:
 # Tab 4: Atribuir Cliente-Colaborador (No direct change for client type filter here, but uses latest client list)
 with tab4:
     st.subheader("Atribuir Clientes a Colaboradores")
-    colaboradores_assign = manager.listar_colaboradores_local()
+    colaboradores_assign = colaboradores_all
     if not colaboradores_assign:
          st.warning("Nenhum colaborador ('Usuario') cadastrado.")
     else:
@@ -251,7 +253,7 @@ with tab4:
             st.write(f"Editando atribuições para: **{selected_colab_name_assign}**")
 
             # --- Obter TODOS os clientes (lista de dicts com id, nome, tipo) ---
-            all_clients_list_of_dicts = manager.listar_clientes_local()
+            all_clients_list_of_dicts = clientes_all
             
             # Criar um mapa de ID para string de exibição para o format_func
             client_id_to_display_map = {
@@ -267,7 +269,7 @@ with tab4:
 
 
             # --- Filtro de Tipo para Clientes DISPONÍVEIS ---
-            all_client_types_assign = sorted(list(set(c['tipo'] for c in all_clients_list_of_dicts if c['tipo'])))
+            all_client_types_assign = tipos_cliente_all
             selected_type_filter_assign = "Todos"
             if all_client_types_assign:
                 filter_options_assign = ["Todos"] + all_client_types_assign
@@ -345,7 +347,7 @@ with tab5:
     st.divider()
     st.header("Filtros de Validação")
     col_1, col_2, col_3, col_4 = st.columns(4)
-    colaboradores_val = manager.listar_colaboradores_local()
+    colaboradores_val = colaboradores_all
     colab_options_map_val = {"Todos": None}
     colab_options_map_val.update({c['nome_completo']: c['username'] for c in colaboradores_val})
     with col_1:
@@ -353,8 +355,7 @@ with tab5:
     selected_colab_filter_user_val = colab_options_map_val[selected_colab_name_val]
 
     # Filter by Client Type for Validation Tab
-    all_clients_val_tab = manager.listar_clientes_local()
-    available_client_types_val = sorted(list(set(c['tipo'] for c in all_clients_val_tab if c['tipo'])))
+    available_client_types_val = tipos_cliente_all
     
     selected_tipos_val = ["Todos"]
     if available_client_types_val:
@@ -384,7 +385,7 @@ with tab5:
         )
     client_id_filter_val = client_options_val_map.get(selected_client_name_val) # Get ID
 
-    status_options_val = ["Todos"] + config.VALID_STATUSES
+    status_options_val = ["Todos"] + list(config.VALID_STATUSES)
     default_statuses_to_show_val = ['Cadastrado', 'Inválido']
     with col_4:
         selected_status_filter_val = st.multiselect(
@@ -419,7 +420,7 @@ with tab5:
         cols_to_show_editor = [col for col in cols_to_show_editor if col in df_display.columns]
         column_config = {
             "Marcar para Validar": st.column_config.CheckboxColumn(required=True),
-            "Novo Status": st.column_config.SelectboxColumn("Novo Status", options=config.VALID_STATUSES, required=True),
+            "Novo Status": st.column_config.SelectboxColumn("Novo Status", options=list(config.VALID_STATUSES), required=True),
             "Observações": st.column_config.TextColumn("Observações", width="medium"),
             "link_ou_documento": st.column_config.LinkColumn("Link/Documento", width="large", display_text="Abrir/Ver"),
             "status": st.column_config.TextColumn("Status Atual", disabled=True),
@@ -446,13 +447,13 @@ with tab5:
             if num_marked > 0:
                 success_count, fail_count = 0, 0
                 with st.spinner("Processando validações..."):
-                    for index, row in marked_rows.iterrows():
-                        update_success = manager.update_document_status_gsheet_and_local(
-                            doc_id=row['id'], new_status=row['Novo Status'], 
-                            admin_username=admin_username, observacoes=row['Observações']
-                        )
-                        if update_success: success_count += 1
-                        else: fail_count += 1; st.warning(f"Falha ao processar ID: {row['id']}")
+                    # One batched update per collaborator sheet instead of one round-trip per document
+                    updated_ids, failed_ids = manager.update_documents_status_gsheet_and_local(
+                        list(zip(marked_rows['id'], marked_rows['Novo Status'], marked_rows['Observações'])),
+                        admin_username=admin_username
+                    )
+                    success_count, fail_count = len(updated_ids), len(failed_ids)
+                    for failed_id in failed_ids: st.warning(f"Falha ao processar ID: {failed_id}")
                 st.toast(f"Processamento concluído!")
                 if success_count > 0: st.success(f"{success_count} documentos atualizados!")
                 if fail_count > 0: st.error(f"{fail_count} validações falharam.")
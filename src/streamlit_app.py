@@ -1,12 +1,17 @@
 # streamlit_app.py
 import streamlit as st
 import os
+import logging
 import pandas as pd
 from streamlit.errors import StreamlitAPIException # Import for switch_page exception
 
 import config
 from hybrid_db import HybridDBManager, Autenticador
 
+# --- Logging (configured once per process; modules log via logging.getLogger(__name__)) ---
+logging.basicConfig(level=os.environ.get("SAI_LOG_LEVEL", "INFO"),
+                    format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+
 # --- Page Configuration ---
 st.set_page_config(
     page_title=config.APP_TITLE,